@@ -3,11 +3,25 @@
 # This Source Code Form is subject to the terms of the Mozilla Public
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
+import hashlib
+import multiprocessing
 import os
+import shutil
 import sys
 import subprocess
+from distutils.spawn import find_executable
 from optparse import OptionParser
 
+# Native builds are kept here, keyed by their sources, compiler and flags.
+CacheFolder = '.native-cache'
+
+SourceExtensions = ['.c', '.cc', '.cpp', '.h', '.hpp', '.in', '.am', '.ac']
+SourceNames = ['Makefile', 'makefile', 'configure']
+
+# Number of jobs every make runs with. The builds run next to each other, so
+# they split the cpus between them.
+MakeJobs = multiprocessing.cpu_count()
+
 class FolderChanger:
     def __init__(self, folder):
         self.old = os.getcwd()
@@ -30,7 +44,8 @@ def MakeEnv(options, args):
     return env
 
 def Make(options, args):
-    subprocess.check_output(['make', '-j4'], stderr=subprocess.STDOUT, env=os.environ)
+    subprocess.check_output(['make', '-j' + str(MakeJobs)],
+                            stderr=subprocess.STDOUT, env=os.environ)
 
 def Configure(options, args, path, extra = []):
     # Bypass normal MakeEnv since we expect the benchmark to pass -O2 automatically.
@@ -38,26 +53,90 @@ def Configure(options, args, path, extra = []):
     args = [path] + extra
     subprocess.check_output(args, stderr=subprocess.STDOUT, env=env)
 
+def CompilerId(command):
+    argv = command.strip('"').split(' ')
+    path = find_executable(argv[0]) or argv[0]
+    version = subprocess.check_output(argv + ['--version'], stderr=subprocess.STDOUT)
+    return ' '.join([os.path.realpath(path)] + argv[1:]) + '\n' + version
+
+def HashSources(h, folder):
+    for root, dirs, files in os.walk(folder):
+        dirs.sort()
+        for name in sorted(files):
+            # Files generated from a .in template change when configuring.
+            if name + '.in' in files:
+                continue
+            if os.path.splitext(name)[1] not in SourceExtensions and name not in SourceNames:
+                continue
+            path = os.path.join(root, name)
+            h.update(path + '\0')
+            with open(path, 'rb') as fp:
+                h.update(fp.read())
+
+def CacheKey(benchmark, options, args):
+    h = hashlib.sha1()
+    for folder in benchmark.sources:
+        HashSources(h, folder)
+    h.update(CompilerId(options.cc))
+    h.update(CompilerId(options.cxx))
+    h.update('\0'.join(args))
+    return h.hexdigest()
+
+def CachedBuild(options, args, benchmark):
+    """
+    Builds the benchmark, unless a build with the same sources, compilers
+    and flags is in the cache.
+    """
+    cached = os.path.join(CacheFolder, benchmark.name + '-' + CacheKey(benchmark, options, args))
+    if os.path.isfile(cached):
+        if not os.path.isdir(os.path.dirname(benchmark.product)):
+            os.makedirs(os.path.dirname(benchmark.product))
+        shutil.copy2(cached, benchmark.product)
+        return benchmark.binary
+
+    binary = benchmark.build(options, args)
+    if not os.path.isdir(CacheFolder):
+        os.makedirs(CacheFolder)
+    shutil.copy2(benchmark.product, cached + '.tmp')
+    os.rename(cached + '.tmp', cached)
+    return binary
+
+def BuildInProcess(job):
+    # The builds change directory, so they run in processes instead of threads.
+    index, options, args = job
+    try:
+        return CachedBuild(options, args, Benchmarks[index])
+    except subprocess.CalledProcessError as e:
+        # CalledProcessError can't be sent back to the parent process.
+        raise Exception(str(e) + '\n' + (e.output or ''))
+
 class Box2D(object):
     def __init__(self):
         self.name = 'box2d'
+        self.sources = ['box2d']
+        self.product = self.binary = os.path.join('box2d', 'run-box2d')
 
     def build(self, options, args):
         env = MakeEnv(options, args)
+        jobs = '-j' + str(MakeJobs)
         with FolderChanger('box2d'):
             subprocess.check_output(['make', 'clean'], stderr=subprocess.STDOUT, env=env)
-            subprocess.check_output(['make'], stderr=subprocess.STDOUT, env=env)
+            subprocess.check_output(['make', jobs], stderr=subprocess.STDOUT, env=env)
         return os.path.join('box2d', 'run-box2d')
 
 class LuaBinaryTrees(object):
     def __init__(self):
         self.name = 'lua_binarytrees'
+        self.sources = ['lua']
+        self.product = os.path.join('lua', 'src', 'lua')
+        self.binary = os.path.join('lua', 'run-lua-binarytrees.sh')
 
     def build(self, options, args):
         env = MakeEnv(options, args)
         with FolderChanger('lua'):
             subprocess.call(['make', 'clean'], stderr=subprocess.STDOUT, env=env)
-            vec = ['make', 'generic', 'MYCFLAGS=' + env['CFLAGS']]
+            vec = ['make', '-j' + str(MakeJobs), 'generic',
+                   'MYCFLAGS=' + env['CFLAGS']]
             try:
                 subprocess.check_output(vec, stderr=subprocess.STDOUT, env=env)
             except subprocess.CalledProcessError, e:
@@ -68,6 +147,8 @@ class LuaBinaryTrees(object):
 class Bullet(object):
     def __init__(self):
         self.name = 'bullet'
+        self.sources = ['bullet']
+        self.product = self.binary = os.path.join('build-bullet', 'bullet')
 
     def build(self, options, args):
         extra = ['--disable-demos', '--disable-dependency-tracking']
@@ -105,6 +186,8 @@ class Bullet(object):
 class Zlib(object):
     def __init__(self):
         self.name = 'zlib'
+        self.sources = ['zlib']
+        self.product = self.binary = os.path.join('zlib', 'run-zlib')
 
     def build(self, options, args):
         with FolderChanger('zlib'):
@@ -131,9 +214,18 @@ Benchmarks = [Box2D(),
              ]
 
 def BenchmarkNative(options, args):
-    for benchmark in Benchmarks:
-        binary = benchmark.build(options, args)
-
+    global MakeJobs
+
+    processes = min(len(Benchmarks), multiprocessing.cpu_count())
+    MakeJobs = max(1, multiprocessing.cpu_count() // processes)
+    pool = multiprocessing.Pool(processes)
+    try:
+        binaries = pool.map(BuildInProcess, [(i, options, args) for i in range(len(Benchmarks))])
+    finally:
+        pool.close()
+        pool.join()
+
+    for benchmark, binary in zip(Benchmarks, binaries):
         # factor 1: loadtime
         with open('/dev/null', 'w') as fp:
             before = os.times()[4]
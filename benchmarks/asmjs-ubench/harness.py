@@ -3,9 +3,14 @@
 # This Source Code Form is subject to the terms of the Mozilla Public
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
+import hashlib
+import multiprocessing
 import os
+import shutil
 import sys
 import subprocess
+from distutils.spawn import find_executable
+from multiprocessing.pool import ThreadPool
 from optparse import OptionParser
 
 Benchmarks = ['copy',
@@ -26,6 +31,14 @@ JSBenchmarks = Benchmarks + SimdBenchmarks
 
 RunFactor = '4'
 
+# Native builds are kept here, keyed by their source, compiler and flags.
+CacheFolder = '.native-cache'
+
+def CompilerId(argv):
+    path = find_executable(argv[0]) or argv[0]
+    version = subprocess.check_output(argv + ['--version'], stderr=subprocess.STDOUT)
+    return ' '.join([os.path.realpath(path)] + argv[1:]) + '\n' + version
+
 def BuildNative(options, args, benchmark):
     try:
         os.remove('run-' + benchmark)
@@ -33,23 +46,41 @@ def BuildNative(options, args, benchmark):
         pass
 
     if os.path.isfile(benchmark + '.cpp'):
-        argv = options.cxx.strip('"').split(' ')
-        argv += [benchmark + '.cpp']
+        compiler = options.cxx.strip('"').split(' ')
+        source = benchmark + '.cpp'
+        extra = []
     else:
-        argv = options.cc.strip('"').split(' ')
-        argv += [benchmark + '.c', '-std=gnu99']
+        compiler = options.cc.strip('"').split(' ')
+        source = benchmark + '.c'
+        extra = ['-std=gnu99']
 
     if len(args) == 0:
         args = ['-O2']
 
-    argv.extend(args)
-    argv.extend(['-o', 'run-' + benchmark])
+    h = hashlib.sha1()
+    with open(source, 'rb') as fp:
+        h.update(fp.read())
+    h.update(CompilerId(compiler))
+    h.update('\0'.join(extra + args))
+    cached = os.path.join(CacheFolder, benchmark + '-' + h.hexdigest())
+
+    if not os.path.isfile(cached):
+        argv = compiler + [source] + extra + args + ['-o', cached + '.tmp']
+        subprocess.check_call(argv)
+        os.rename(cached + '.tmp', cached)
 
-    subprocess.check_call(argv)
+    shutil.copy2(cached, 'run-' + benchmark)
 
 def BenchmarkNative(options, args):
-    for benchmark in Benchmarks:
-        BuildNative(options, args, benchmark)
+    if not os.path.isdir(CacheFolder):
+        os.makedirs(CacheFolder)
+
+    pool = ThreadPool(multiprocessing.cpu_count())
+    try:
+        pool.map(lambda benchmark: BuildNative(options, args, benchmark), Benchmarks)
+    finally:
+        pool.close()
+        pool.join()
 
     for benchmark in Benchmarks:
         with open('/dev/null', 'w') as fp:
@@ -0,0 +1,165 @@
+# vim: set ts=4 sw=4 tw=99 et:
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# Raw months older than ArchiveAfterMonths don't get new datapoints anymore.
+# They get sealed into compressed segments next to the shard's manifest:
+#
+#   <series>-archive-<n>.json.gz  the raw graphs of the months sealed in one
+#                                 pass
+#   <series>-sealed.json.gz       the raw points of all sealed months combined,
+#                                 which is all condenser.aggregate reads of them
+#
+# The segments are only read again when a month gets unsealed, or when a
+# month older than the sealed ones gets sealed. Otherwise new months are
+# appended to the combined graph. The manifest keeps the entries of sealed
+# months, marked with their segment, and lists the segments of every series
+# under 'archives'. Condensed files are not archived, since the website
+# requests them by name.
+
+import os
+import gzip
+import time
+import awfy, util
+from manifest import month_key, parse_month_key
+
+ArchiveAfterMonths = 12
+
+def cutoff():
+    t = time.gmtime()
+    year = t.tm_year - ArchiveAfterMonths // 12
+    month = t.tm_mon - ArchiveAfterMonths % 12
+    if month < 1:
+        month += 12
+        year -= 1
+    return (year, month)
+
+def write_json(path, j):
+    with gzip.open(path + '.tmp', 'wb') as fp:
+        fp.write(util.json_dumps(j))
+    os.rename(path + '.tmp', path)
+
+def read_json(path):
+    with gzip.open(path, 'rb') as fp:
+        return util.json_load(fp)
+
+def folder(manifest):
+    return os.path.join(awfy.path, manifest.folder)
+
+def month_order(key):
+    year, month = parse_month_key(key)
+    return year * 12 + month
+
+# Returns the combined graph of all sealed months of a series, or None.
+def sealed_graph(manifest, series):
+    info = manifest.archives.get(series)
+    if not info:
+        return None
+    return read_json(os.path.join(folder(manifest), info['combined']))['graph']
+
+# Rewrite the combined graph of the sealed months. Newly sealed months which
+# all come after the sealed ones only get appended, otherwise it is combined
+# anew from the segments.
+def write_combined(manifest, series, info, added=None):
+    import condenser
+
+    if added and info.get('last') and \
+       min(month_order(key) for key in added) > month_order(info['last']):
+        graphs = [sealed_graph(manifest, series)]
+        months = added
+    else:
+        graphs = []
+        months = { }
+        for segment_name in info['segments']:
+            months.update(read_json(os.path.join(folder(manifest), segment_name))['months'])
+
+    keys = sorted(months, key=month_order)
+    graphs += [months[key] for key in keys]
+    info['last'] = keys[-1]
+
+    info['combined'] = series + '-sealed.json.gz'
+    write_json(os.path.join(folder(manifest), info['combined']),
+               { 'version': awfy.version, 'graph': condenser.combine(graphs) })
+
+# Seal all months older than the cutoff. Expects the months to be condensed
+# already, so their condensed files stay valid.
+def seal(manifest, series):
+    last = cutoff()
+    months = [(when, path) for when, path in manifest.months(series) if when < last]
+    if not len(months):
+        return False
+
+    info = manifest.archives.get(series, { 'segments': [], 'combined': None })
+    number = info.get('next', len(info['segments']))
+
+    segment = { }
+    for when, path in months:
+        with open(os.path.join(awfy.path, path)) as fp:
+            segment[month_key(when)] = util.json_load(fp)['graph']
+
+    segment_name = series + '-archive-' + str(number) + '.json.gz'
+    write_json(os.path.join(folder(manifest), segment_name),
+               { 'version': awfy.version, 'months': segment })
+
+    info['segments'].append(segment_name)
+    info['next'] = number + 1
+    write_combined(manifest, series, info, segment)
+
+    for when, path in months:
+        manifest.entry(series, when)['segment'] = segment_name
+    manifest.archives[series] = info
+    manifest.dirty = True
+    manifest.save()
+
+    # Only remove the raw files once the manifest points to the segment.
+    for when, path in months:
+        os.remove(os.path.join(awfy.path, path))
+
+    return True
+
+# Move sealed months of a series back into raw files, e.g. because an old
+# month needs to be renewed. Without a month all of them get unsealed.
+# Otherwise only that month leaves its segment.
+def unseal(manifest, series, when=None):
+    info = manifest.archives.get(series)
+    if not info:
+        return
+
+    if when is None:
+        segments = list(info['segments'])
+    else:
+        if not manifest.is_sealed(series, when):
+            return
+        segments = [manifest.entry(series, when)['segment']]
+
+    removed = []
+    for segment_name in segments:
+        path = os.path.join(folder(manifest), segment_name)
+        segment = read_json(path)
+        keys = segment['months'].keys() if when is None else [month_key(when)]
+        for key in keys:
+            manifest.write(series, parse_month_key(key), { 'version': awfy.version,
+                                                           'graph': segment['months'][key] })
+
+        if len(keys) == len(segment['months']):
+            info['segments'].remove(segment_name)
+            removed.append(segment_name)
+            continue
+
+        for key in keys:
+            del segment['months'][key]
+        write_json(path, segment)
+
+    if info['segments']:
+        write_combined(manifest, series, info)
+    else:
+        removed.append(info['combined'])
+        del manifest.archives[series]
+    manifest.dirty = True
+    manifest.save()
+
+    for name in removed:
+        path = os.path.join(folder(manifest), name)
+        if os.path.exists(path):
+            os.remove(path)
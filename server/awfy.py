@@ -18,6 +18,7 @@ path = None
 th_host = None
 th_user = None
 th_secret = None
+condense_processes = 1
 
 queries = 0
 
@@ -66,7 +67,7 @@ class DBCursor:
 
 
 def Startup():
-    global db, version, path, th_host, th_user, th_secret
+    global db, version, path, th_host, th_user, th_secret, condense_processes
     config = ConfigParser.RawConfigParser()
     config.read("/etc/awfy-server.config")
 
@@ -82,6 +83,8 @@ def Startup():
     version = int(row[0])
 
     path = config.get('general', 'data_folder')
+    if config.has_option('general', 'condense_processes'):
+        condense_processes = config.getint('general', 'condense_processes')
 
     if config.has_section('treeherder'):
         th_host = config.get('treeherder', 'host')
@@ -3,29 +3,20 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at http://mozilla.org/MPL/2.0/.
 
-import re
 import os
 import sys
 import awfy, util
 import math
+import archive
+import summary
+import multiprocessing
+from manifest import Manifest
 from profiler import Profiler
 from datetime import datetime
-import glob
 
 SecondsPerDay = 60 * 60 * 24
 MaxRecentRuns = 30
 
-class FolderChanger:
-    def __init__(self, folder):
-        self.old = os.getcwd()
-        self.new = folder
-
-    def __enter__(self):
-        os.chdir(self.new)
-
-    def __exit__(self, type, value, traceback):
-        os.chdir(self.old)
-
 def export(name, j):
     path = os.path.join(awfy.path, name)
     if os.path.exists(path):
@@ -33,23 +24,8 @@ def export(name, j):
     with open(path, 'w') as fp:
         util.json_dump(j, fp)
 
-def find_all_months(cx, prefix, name):
-    pattern = prefix + 'raw-' + name + '-*-*.json'
-    re_pattern = prefix + 'raw-' + name + '-(\d\d\d\d)-(\d+)\.json'
-
-    with FolderChanger(awfy.path):
-        files = []
-        for file in glob.glob(pattern):
-            m = re.match(re_pattern, file)
-            if not m:
-                continue
-
-            year = int(m.group(1))
-            month = int(m.group(2))
-            files.append(((year, month), file))
-
-    files = sorted(files, key=lambda key: key[0][0] * 12 + key[0][1])
-    return files
+def find_all_months(cx, manifest, prefix, name):
+    return manifest.months(prefix + 'raw-' + name)
 
 def retrieve_graphs(cx, files):
     graphs = []
@@ -173,14 +149,31 @@ def combine(graphs):
 
     return combined
 
-def aggregate(cx, prefix, name):
+# Order the points of a graph by time.
+def sort_graph(graph):
+    order = sorted(range(len(graph['timelist'])), key=lambda i: graph['timelist'][i])
+    graph['timelist'] = [graph['timelist'][i] for i in order]
+    for line in graph['lines']:
+        line['data'] = [line['data'][i] for i in order]
+
+def aggregate(cx, manifest, prefix, name):
     with Profiler() as p:
         sys.stdout.write('Aggregating ' + name + '... ')
         sys.stdout.flush()
 
-        files = find_all_months(cx, prefix, name)
-        graphs = retrieve_graphs(cx, files)
-        graph = combine([graph for when, graph in graphs])
+        files = find_all_months(cx, manifest, prefix, name)
+        graphs = [graph for when, graph in retrieve_graphs(cx, files)]
+
+        # Sealed months are only read as one precombined graph.
+        sealed = archive.sealed_graph(manifest, prefix + 'raw-' + name)
+        if sealed:
+            graphs.insert(0, sealed)
+        graph = combine(graphs)
+
+        # A month that was unsealed to get renewed can be older than months
+        # that are still sealed.
+        if sealed:
+            sort_graph(graph)
 
         graph['aggregate'] = True
 
@@ -200,8 +193,10 @@ def aggregate(cx, prefix, name):
             runs.append(0)
         for i in range(len(graph['timelist'])-1, -1, -1):
             for j in range(len(graph['lines'])):
-                if graph['lines'] and i < len(graph['lines'][j]["data"]) and graph['lines'][j]["data"][i]:
-                    runs[j] += 1
+                if graph['lines'] and i < len(graph['lines'][j]["data"]):
+                    point = graph['lines'][j]["data"][i]
+                    if point and point[0]:
+                        runs[j] += 1
             recentRuns += 1
             if max(runs) == MaxRecentRuns:
                 break
@@ -245,15 +240,18 @@ def aggregate(cx, prefix, name):
     print('took ' + diff)
     return new_graph
 
+def condensed_name(prefix, name, when):
+    return prefix + 'condensed-' + name + '-' + str(when[0]) + '-' + str(when[1])
+
 def file_is_newer(file1, file2):
     return os.path.getmtime(file1) >= os.path.getmtime(file2)
 
-def condense(cx, prefix, name):
+def condense(cx, manifest, prefix, name):
     with Profiler() as p:
         sys.stdout.write('Importing all datapoints for ' + name + '... ')
         sys.stdout.flush()
 
-        files = find_all_months(cx, prefix, name)
+        files = find_all_months(cx, manifest, prefix, name)
         diff = p.time()
 
     print('took ' + diff)
@@ -264,43 +262,78 @@ def condense(cx, prefix, name):
     change = False
 
     for when, raw_file in files:
-        condensed_name = prefix + 'condensed-' + name + '-' + str(when[0]) + '-' + str(when[1])
-        condensed_file = condensed_name + '.json'
+        month_name = condensed_name(prefix, name, when)
+        condensed_file = month_name + '.json'
 
-        # Only update the graph when condensed file is older.
-        if os.path.exists(os.path.join(awfy.path, condensed_file)) and file_is_newer(os.path.join(awfy.path, condensed_file), os.path.join(awfy.path, raw_file)):
+        # Only update the graph when the raw month changed since it was last
+        # condensed.
+        series = prefix + 'raw-' + name
+        if manifest.is_condensed(series, when):
+            continue
+
+        # Months imported from the flat layout have no hash yet. Fall back to
+        # comparing the file times.
+        if manifest.entry(series, when)['hash'] is None and \
+           os.path.exists(os.path.join(awfy.path, condensed_file)) and \
+           file_is_newer(os.path.join(awfy.path, condensed_file), os.path.join(awfy.path, raw_file)):
             continue
 
         # There was a datapoint added to one of the condensed files.
         change = True
 
         with Profiler() as p:
-            sys.stdout.write('Condensing ' + condensed_name + '... ')
+            sys.stdout.write('Condensing ' + month_name + '... ')
             sys.stdout.flush()
 
             graph = retrieve_graph(cx, raw_file)
 
-            condense_month(cx, graph, prefix, condensed_name)
+            condense_month(cx, graph, prefix, month_name)
+            manifest.mark_condensed(series, when)
             diff = p.time()
         print(' took ' + diff)
 
     return change
 
-def condense_suite(cx, machine, suite):
+# Seal the months of a series that are too old to still get datapoints. Their
+# condensed files have to be current first, since the raw months can't be
+# condensed anymore once they are sealed.
+def seal(cx, manifest, prefix, name):
+    series = prefix + 'raw-' + name
+    last = archive.cutoff()
+    for when, raw_file in find_all_months(cx, manifest, prefix, name):
+        if when >= last or manifest.is_condensed(series, when):
+            continue
+        graph = retrieve_graph(cx, raw_file)
+        condense_month(cx, graph, prefix, condensed_name(prefix, name, when))
+        manifest.mark_condensed(series, when)
+    archive.seal(manifest, series)
+
+def condense_suite(cx, machine, suite, summaries):
     name = suite.name + '-' + str(machine.id)
     prefix = ""
     if suite.visible == 2:
         prefix = "auth-"
 
+    manifest = Manifest(machine.id, suite.name)
+
+    # Hidden suites are not summarized, since the summary file is public.
+    if suite.visible == 2:
+        summaries.pop(suite.name, None)
+        suite_summary = None
+    else:
+        suite_summary = summaries.setdefault(suite.name, { 'lines': None, 'tests': { } })
+
     # Condense suite
-    change = condense(cx, prefix, name)
+    change = condense(cx, manifest, prefix, name)
+    if suite_summary and (change or suite_summary['lines'] is None):
+        suite_summary['lines'] = summary.summarize(manifest, prefix + 'raw-' + name)
 
     # Aggregate suite if needed.
     aggregated_file = prefix + 'aggregate-' + name + '.json'
     if change:
         j = {
             'version': awfy.version,
-            'graph': aggregate(cx, prefix, name)
+            'graph': aggregate(cx, manifest, prefix, name)
         }
 
         export(aggregated_file, j)
@@ -310,43 +343,110 @@ def condense_suite(cx, machine, suite):
             test_path = suite.name + '-' + subtest.name + '-' + str(machine.id)
 
             # Condense test
-            change = condense(cx, prefix + 'bk-', test_path)
+            change = condense(cx, manifest, prefix + 'bk-', test_path)
+            if suite_summary and (change or subtest.name not in suite_summary['tests']):
+                suite_summary['tests'][subtest.name] = summary.summarize(manifest, prefix + 'bk-raw-' + test_path)
 
             # Aggregate suite if needed.
             if change:
                 j = {
                     'version': awfy.version,
-                    'graph': aggregate(cx, prefix + 'bk-', test_path)
+                    'graph': aggregate(cx, manifest, prefix + 'bk-', test_path)
                 }
                 export(prefix + 'bk-aggregate-' + test_path + '.json', j)
 
+    # Seal the months that are too old to still get datapoints.
+    seal(cx, manifest, prefix, name)
+    for subtest in suite.tests:
+        test_path = suite.name + '-' + subtest.name + '-' + str(machine.id)
+        seal(cx, manifest, prefix + 'bk-', test_path)
+
+    manifest.save()
+
     if not os.path.exists(os.path.join(awfy.path, aggregated_file)):
         return None
     return retrieve_graph(cx, aggregated_file)
 
 
+# Context shared with the condense workers. They are forked after it is set,
+# so only the indices of the machine and suite have to be sent over.
+pool_cx = None
+
+def condense_job(job):
+    machine_index, suite_index, suite_summary = job
+    machine = pool_cx.machines[machine_index]
+    suite = pool_cx.benchmarks[suite_index]
+
+    summaries = { }
+    if suite_summary is not None:
+        summaries[suite.name] = suite_summary
+    suite_aggregate = condense_suite(pool_cx, machine, suite, summaries)
+    return suite_aggregate, summaries.get(suite.name)
+
 def condense_all(cx):
-    for machine in cx.machines:
+    global pool_cx
+    pool_cx = cx
+
+    # Every (machine, suite) pair only touches its own files, so they can be
+    # condensed independently.
+    jobs = []
+    summaries = { }
+    for machine_index, machine in enumerate(cx.machines):
         # If a machine is set to no longer report scores, don't condense it.
         if machine.active == 2:
             continue
 
-        aggregates = { }
-        for suite in cx.benchmarks:
+        summaries[machine.id] = summary.load(machine)
+        for suite_index, suite in enumerate(cx.benchmarks):
             if suite.name == 'v8':
                 continue
-            suite_aggregate = condense_suite(cx, machine, suite)
-            if suite.name == 'misc':
-                continue
-            if suite.visible == 2:
-                continue
-            if suite_aggregate == None:
-                continue
-            aggregates[suite.name] = suite_aggregate
+            jobs.append((machine_index, suite_index, summaries[machine.id].get(suite.name)))
+
+    if awfy.condense_processes > 1:
+        pool = multiprocessing.Pool(awfy.condense_processes)
+        try:
+            results = pool.map(condense_job, jobs, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        results = [condense_job(job) for job in jobs]
+
+    aggregates = { }
+    for job, result in zip(jobs, results):
+        machine = cx.machines[job[0]]
+        suite = cx.benchmarks[job[1]]
+        suite_aggregate, suite_summary = result
+
+        if suite_summary is None:
+            summaries[machine.id].pop(suite.name, None)
+        else:
+            summaries[machine.id][suite.name] = suite_summary
+
+        if suite.name == 'misc':
+            continue
+        if suite.visible == 2:
+            continue
+        if suite_aggregate == None:
+            continue
+        aggregates.setdefault(machine.id, { })[suite.name] = suite_aggregate
+
+    for machine in cx.machines:
+        if machine.active == 2:
+            continue
 
         j = {
             'version': awfy.version,
-            'graphs': aggregates
+            'graphs': aggregates.get(machine.id, { })
         }
 
         export('aggregate-' + str(machine.id) + '.json', j)
+
+        # Small sidecar with the per line statistics, so the overview pages
+        # don't need to download every aggregate graph.
+        j = {
+            'version': awfy.version,
+            'summaries': summaries[machine.id]
+        }
+
+        export('summary-' + str(machine.id) + '.json', j)
@@ -0,0 +1,176 @@
+# vim: set ts=4 sw=4 tw=99 et:
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import os
+import re
+import glob
+import hashlib
+import awfy, util
+
+# Raw monthly caches are sharded per machine and per suite:
+#
+#   <data_folder>/series/<machine>/<suite>/<series>-<year>-<month>.json
+#
+# Every shard folder has a manifest.json which indexes the months of all
+# series (suite, subtests and their auth- variants) stored in it, so the
+# condenser never has to scan the data folder. Files written by older
+# versions live flat in the data folder. They are picked up lazily the first
+# time a series is requested and moved into the shard on their next update.
+
+ManifestVersion = 1
+SeriesFolder = 'series'
+
+def month_key(when):
+    return str(when[0]) + '-' + str(when[1])
+
+def parse_month_key(key):
+    year, month = key.split('-')
+    return (int(year), int(month))
+
+def graph_hash(text):
+    return hashlib.sha1(text).hexdigest()
+
+class Manifest(object):
+    def __init__(self, machine_id, suite_name):
+        self.folder = os.path.join(SeriesFolder, str(machine_id), suite_name)
+        self.file = os.path.join(awfy.path, self.folder, 'manifest.json')
+        self.dirty = False
+
+        try:
+            with open(self.file) as fp:
+                manifest = util.json_load(fp)
+            self.series = manifest['series']
+            self.archives = manifest.get('archives', { })
+        except:
+            self.series = { }
+            self.archives = { }
+
+    def filename(self, series, when):
+        return series + '-' + str(when[0]) + '-' + str(when[1]) + '.json'
+
+    # Path of a month relative to the data folder.
+    def path(self, series, when):
+        entry = self.entries(series).get(month_key(when))
+        name = self.filename(series, when)
+        if entry and entry.get('legacy'):
+            return name
+        return os.path.join(self.folder, name)
+
+    def full_path(self, series, when):
+        return os.path.join(awfy.path, self.path(series, when))
+
+    def entries(self, series):
+        if series not in self.series:
+            self.series[series] = self.import_legacy(series)
+            self.dirty = True
+        return self.series[series]
+
+    # Compatibility shim: register the flat files of a series written before
+    # the sharded layout existed. Only happens once per series.
+    def import_legacy(self, series):
+        pattern = series + '-*-*.json'
+        re_pattern = re.escape(series) + '-(\d\d\d\d)-(\d+)\.json$'
+
+        entries = { }
+        for file in glob.glob(os.path.join(awfy.path, pattern)):
+            m = re.match(re_pattern, os.path.basename(file))
+            if not m:
+                continue
+            when = (int(m.group(1)), int(m.group(2)))
+            entries[month_key(when)] = { 'legacy': True,
+                                         'points': None,
+                                         'watermark': None,
+                                         'hash': None
+                                       }
+        return entries
+
+    # Returns all months of a series as ((year, month), path) sorted by date.
+    # Months which are sealed in the archive are left out.
+    def months(self, series):
+        months = []
+        for key, entry in self.entries(series).items():
+            if 'segment' in entry:
+                continue
+            when = parse_month_key(key)
+            months.append((when, self.path(series, when)))
+        return sorted(months, key=lambda key: key[0][0] * 12 + key[0][1])
+
+    def entry(self, series, when):
+        return self.entries(series).get(month_key(when))
+
+    def is_sealed(self, series, when):
+        entry = self.entry(series, when)
+        return entry is not None and 'segment' in entry
+
+    def write(self, series, when, j):
+        text = util.json_dumps(j)
+        graph = j['graph']
+
+        folder = os.path.join(awfy.path, self.folder)
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+
+        old = self.entry(series, when)
+        if old and old.get('legacy'):
+            legacy = os.path.join(awfy.path, self.filename(series, when))
+            if os.path.exists(legacy):
+                os.remove(legacy)
+
+        path = os.path.join(folder, self.filename(series, when))
+        with open(path, 'w') as fp:
+            fp.write(text)
+
+        entry = { 'points': len(graph['timelist']),
+                  'watermark': graph['timelist'][-1] if len(graph['timelist']) else None,
+                  'hash': graph_hash(text)
+                }
+        if old and 'condensed' in old:
+            entry['condensed'] = old['condensed']
+        self.entries(series)[month_key(when)] = entry
+        self.dirty = True
+
+    def remove(self, series, when):
+        path = self.full_path(series, when)
+        if os.path.exists(path):
+            os.remove(path)
+        self.entries(series).pop(month_key(when), None)
+        self.dirty = True
+
+    # Record a month that was written by another process.
+    def record(self, series, when, entry):
+        if entry is None:
+            self.entries(series).pop(month_key(when), None)
+        else:
+            self.entries(series)[month_key(when)] = entry
+        self.dirty = True
+
+    # Remember which revision of a raw month the condensed file was built from.
+    def mark_condensed(self, series, when):
+        entry = self.entry(series, when)
+        if entry['hash'] is None:
+            return
+        entry['condensed'] = entry['hash']
+        self.dirty = True
+
+    def is_condensed(self, series, when):
+        entry = self.entry(series, when)
+        if not entry or entry['hash'] is None:
+            return False
+        return entry.get('condensed') == entry['hash']
+
+    def save(self):
+        if not self.dirty:
+            return
+        folder = os.path.dirname(self.file)
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        tmp = self.file + '.tmp'
+        with open(tmp, 'w') as fp:
+            util.json_dump({ 'version': ManifestVersion,
+                             'series': self.series,
+                             'archives': self.archives
+                           }, fp)
+        os.rename(tmp, self.file)
+        self.dirty = False
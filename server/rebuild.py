@@ -0,0 +1,209 @@
+# vim: set ts=4 sw=4 tw=99 et:
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+# Rebuilds all raw month caches from the database, one month of one series
+# at a time. Finished months are recorded in a checkpoint, so an interrupted
+# rebuild continues where it stopped when started again.
+
+import os
+import sys
+import time
+import awfy
+import data
+import util
+import update
+import archive
+import multiprocessing
+from manifest import Manifest, month_key
+from profiler import Profiler
+from optparse import OptionParser
+
+CheckpointFile = 'rebuild-checkpoint.json'
+CheckpointInterval = 50
+
+def load_checkpoint():
+    try:
+        with open(os.path.join(awfy.path, CheckpointFile)) as fp:
+            return util.json_load(fp)
+    except:
+        return None
+
+def save_checkpoint(checkpoint):
+    path = os.path.join(awfy.path, CheckpointFile)
+    with open(path + '.tmp', 'w') as fp:
+        util.json_dump(checkpoint, fp)
+    os.rename(path + '.tmp', path)
+
+def delete_checkpoint():
+    path = os.path.join(awfy.path, CheckpointFile)
+    if os.path.exists(path):
+        os.remove(path)
+
+def first_month(machine):
+    c = awfy.db.cursor()
+    c.execute("SELECT MIN(approx_stamp) FROM awfy_run WHERE machine = %s AND status > 0",
+              (machine.id,))
+    row = c.fetchone()
+    if not row or not row[0]:
+        return None
+    t = time.gmtime(int(row[0]))
+    return (t.tm_year, t.tm_mon)
+
+def months_between(first, last):
+    months = []
+    year, month = first
+    while (year, month) <= last:
+        months.append((year, month))
+        month += 1
+        if month == 13:
+            month = 1
+            year += 1
+    return months
+
+# Context shared with the rebuild workers, see condenser.pool_cx.
+pool_cx = None
+pool_db = None
+
+def init_worker():
+    global pool_db
+
+    # The forked connection is shared with the parent. Keep it referenced so
+    # it doesn't get closed underneath the parent, and open our own.
+    pool_db = awfy.db
+    awfy.db = awfy.DB(pool_db.host, pool_db.user, pool_db.pw, pool_db.name)
+
+def rebuild_month(job):
+    machine_index, suite_index, series_index, when, started = job
+    machine = pool_cx.machines[machine_index]
+    suite = pool_cx.benchmarks[suite_index]
+    prefix, direction, fetch = update.suite_series(machine, suite)[series_index]
+
+    manifest = Manifest(machine.id, suite.name)
+    update.delete_month(manifest, prefix, when)
+
+    # Only take runs that finished before the rebuild started. Everything
+    # after that gets picked up by the next regular update.
+    rows = fetch(machine, finish_stamp=(0, started), approx_stamp=update.month_stamps(when))
+    if len(rows):
+        update.update_cache(pool_cx, direction, manifest, prefix, when, rows)
+
+    return job, manifest.entry(prefix, when), len(rows)
+
+def rebuild(cx, processes, restart):
+    global pool_cx
+    pool_cx = cx
+
+    checkpoint = None if restart else load_checkpoint()
+    if checkpoint:
+        print('Resuming rebuild, ' + str(len(checkpoint['done'])) + ' months already done')
+    else:
+        checkpoint = { 'started': int(time.time()),
+                       'done': []
+                     }
+        save_checkpoint(checkpoint)
+    started = checkpoint['started']
+    done = set(checkpoint['done'])
+
+    t = time.gmtime(started)
+    last = (t.tm_year, t.tm_mon)
+
+    jobs = []
+    for machine_index, machine in enumerate(cx.machines):
+        if machine.active == 2:
+            continue
+        first = first_month(machine)
+        if not first:
+            continue
+
+        for suite_index, suite in enumerate(cx.benchmarks):
+            # A rebuild renews archived months too. Unpack them up front, the
+            # workers only touch single months.
+            manifest = Manifest(machine.id, suite.name)
+            series = update.suite_series(machine, suite)
+            for prefix, direction, fetch in series:
+                archive.unseal(manifest, prefix)
+
+            for series_index, (prefix, direction, fetch) in enumerate(series):
+                for when in months_between(first, last):
+                    if prefix + '-' + month_key(when) in done:
+                        continue
+                    jobs.append((machine_index, suite_index, series_index, when, started))
+
+    print('Rebuilding ' + str(len(jobs)) + ' months')
+
+    if processes > 1:
+        pool = multiprocessing.Pool(processes, init_worker)
+        results = pool.imap_unordered(rebuild_month, jobs)
+    else:
+        pool = None
+        results = (rebuild_month(job) for job in jobs)
+
+    # Only the parent writes manifests and the checkpoint. Workers write the
+    # month files themselves and report back the manifest entry.
+    manifests = { }
+    def flush():
+        for manifest in manifests.values():
+            manifest.save()
+        save_checkpoint(checkpoint)
+
+    try:
+        with Profiler() as p:
+            for i, (job, entry, rows) in enumerate(results):
+                machine_index, suite_index, series_index, when, started = job
+                machine = cx.machines[machine_index]
+                suite = cx.benchmarks[suite_index]
+                prefix = update.suite_series(machine, suite)[series_index][0]
+
+                key = (machine.id, suite.name)
+                if key not in manifests:
+                    manifests[key] = Manifest(machine.id, suite.name)
+                manifests[key].record(prefix, when, entry)
+                checkpoint['done'].append(prefix + '-' + month_key(when))
+
+                if (i + 1) % CheckpointInterval == 0:
+                    flush()
+
+                print('[' + str(i + 1) + '/' + str(len(jobs)) + '] ' + prefix + '-' +
+                      month_key(when) + ': ' + str(rows) + ' rows')
+            diff = p.time()
+    finally:
+        flush()
+        if pool:
+            pool.close()
+            pool.join()
+    print('Rebuilt all months in ' + diff)
+
+    # Let the regular update continue from the moment the rebuild started.
+    for machine in cx.machines:
+        if machine.active == 2:
+            continue
+        for suite in cx.benchmarks:
+            for prefix, direction, fetch in update.suite_series(machine, suite):
+                metadata = update.load_metadata(prefix)
+                metadata['last_stamp'] = started
+                update.save_metadata(prefix, metadata)
+
+    delete_checkpoint()
+
+def main(argv):
+    parser = OptionParser(usage="usage: %prog [options]")
+    parser.add_option("-p", "--processes", dest="processes", type="int",
+                      default=awfy.condense_processes,
+                      help="Number of months to rebuild in parallel")
+    parser.add_option("--restart", dest="restart", action="store_true", default=False,
+                      help="Ignore the checkpoint of an interrupted rebuild")
+    (options, args) = parser.parse_args(argv)
+
+    sys.stdout.write('Computing master properties... ')
+    sys.stdout.flush()
+    with Profiler() as p:
+        cx = data.Context()
+        diff = p.time()
+    print('took ' + diff)
+
+    rebuild(cx, options.processes, options.restart)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,94 @@
+# vim: set ts=4 sw=4 tw=99 et:
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+
+import os
+import awfy, util
+
+SecondsPerDay = 60 * 60 * 24
+WindowRuns = 30
+ChangeDays = [7, 30]
+
+def median(values):
+    values = sorted(values)
+    mid = len(values) // 2
+    if len(values) % 2:
+        return values[mid]
+    return (values[mid - 1] + values[mid]) / 2.0
+
+def percent_change(new, old):
+    if not old:
+        return None
+    return (new - old) * 100.0 / old
+
+# Summarize one line, given its datapoints as (time, score) sorted by time.
+def summarize_line(points):
+    window = [score for t, score in points[-WindowRuns:]]
+    latest_time, latest = points[-1]
+    med = median(window)
+
+    stats = { 'latest': latest,
+              'latest_time': latest_time,
+              'runs': len(window),
+              'median': med,
+              'mad': median([abs(score - med) for score in window]),
+              'min': min(window),
+              'max': max(window)
+            }
+
+    for days in ChangeDays:
+        before = latest_time - days * SecondsPerDay
+        old = None
+        for t, score in reversed(points):
+            if t <= before:
+                old = score
+                break
+        stats['change_' + str(days) + 'd'] = percent_change(latest, old)
+
+    return stats
+
+def enough_history(lines, earliest):
+    if not lines:
+        return False
+    for points in lines.values():
+        if len(points) < WindowRuns:
+            return False
+    latest = max(points[-1][0] for points in lines.values())
+    return earliest <= latest - max(ChangeDays) * SecondsPerDay
+
+# Compute the summary of every mode of a raw series. Only the most recent
+# months are read, until there is enough history for all statistics.
+def summarize(manifest, series):
+    lines = { }
+    earliest = None
+    for when, file in reversed(manifest.months(series)):
+        with open(os.path.join(awfy.path, file)) as fp:
+            graph = util.json_load(fp)['graph']
+
+        for line in graph['lines']:
+            points = []
+            for i, p in enumerate(line['data']):
+                if not p or not p[0]:
+                    continue
+                points.append((graph['timelist'][i], p[0]))
+            if not points:
+                continue
+            lines[line['modeid']] = points + lines.get(line['modeid'], [])
+
+        if len(graph['timelist']):
+            earliest = graph['timelist'][0]
+        if enough_history(lines, earliest):
+            break
+
+    summaries = { }
+    for modeid, points in lines.items():
+        summaries[modeid] = summarize_line(points)
+    return summaries
+
+def load(machine):
+    try:
+        with open(os.path.join(awfy.path, 'summary-' + str(machine.id) + '.json')) as fp:
+            return util.json_load(fp)['summaries']
+    except:
+        return { }
@@ -10,8 +10,10 @@ import data
 import time
 import util
 import os.path
-import datetime
+import calendar
+import archive
 import condenser, json
+from manifest import Manifest
 from profiler import Profiler
 from builder import LineBuilder, GraphBuilder
 
@@ -110,9 +112,9 @@ def delete_cache(prefix):
     if os.path.exists(os.path.join(awfy.path, prefix + '.json')):
         os.remove(os.path.join(awfy.path, prefix + '.json'))
 
-def open_cache(direction, prefix):
+def open_cache(direction, manifest, series, when):
     try:
-        with open(os.path.join(awfy.path, prefix + '.json')) as fp:
+        with open(manifest.full_path(series, when)) as fp:
             cache = util.json_load(fp)
             return cache['graph']
     except:
@@ -121,15 +123,14 @@ def open_cache(direction, prefix):
                  'direction': direction
                }
 
-def save_cache(prefix, cache):
+def save_cache(manifest, series, when, cache):
     j = {
         'graph': cache,
         'version': awfy.version
     }
-    with open(os.path.join(awfy.path, prefix + '.json'), 'w') as fp:
-        util.json_dump(j, fp)
+    manifest.write(series, when, j)
 
-def update_cache(cx, direction, prefix, when, rows):
+def update_cache(cx, direction, manifest, series, when, rows):
     # Sort everything into separate modes.
     modes = { }
     for row in rows:
@@ -159,8 +160,13 @@ def update_cache(cx, direction, prefix, when, rows):
     graph.fixup()
     new_data = graph.output()
 
+    # Datapoints for an archived month. Unpack that month so it can be
+    # updated.
+    if manifest.is_sealed(series, when):
+        archive.unseal(manifest, series, when)
+
     # Open the old cache.
-    cache = open_cache(direction, prefix)
+    cache = open_cache(direction, manifest, series, when)
 
     # Build a reverse mode mapping for the cache.
     cache_modes = { }
@@ -208,26 +214,36 @@ def update_cache(cx, direction, prefix, when, rows):
             raise Exception('computed datapoints wrong')
 
     # Now save the results.
-    save_cache(prefix, cache)
+    save_cache(manifest, series, when, cache)
     return True
 
-def renew_cache(cx, machine, direction, prefix, when, fetch):
-    delete_cache(prefix + '-' + str(when[0]) + '-' + str(when[1]));
-
-    # Delete corresponding condensed graph
-    before, after = prefix.split("raw", 1)
-    delete_cache(before + "condensed" + after + '-' + str(when[0]) + '-' + str(when[1]));
-
-    dt = datetime.datetime(year=when[0], month=when[1], day=1)
-    start_stamp = int(time.mktime(dt.timetuple()))
+# First and last timestamp of a month. Months are in UTC, like the split in
+# perform_update.
+def month_stamps(when):
+    start_stamp = calendar.timegm((when[0], when[1], 1, 0, 0, 0))
 
     next_month = when[1] + 1
     next_year = when[0]
     if next_month == 13:
         next_month = 1
         next_year += 1
-    dt = datetime.datetime(year=next_year, month=next_month, day=1)
-    stop_stamp = int(time.mktime(dt.timetuple())) - 1
+    stop_stamp = calendar.timegm((next_year, next_month, 1, 0, 0, 0)) - 1
+
+    return start_stamp, stop_stamp
+
+def delete_month(manifest, prefix, when):
+    if manifest.is_sealed(prefix, when):
+        archive.unseal(manifest, prefix, when)
+    manifest.remove(prefix, when)
+
+    # Delete corresponding condensed graph
+    before, after = prefix.split("raw", 1)
+    delete_cache(before + "condensed" + after + '-' + str(when[0]) + '-' + str(when[1]));
+
+def renew_cache(cx, machine, direction, manifest, prefix, when, fetch):
+    delete_month(manifest, prefix, when)
+
+    start_stamp, stop_stamp = month_stamps(when)
 
     name = prefix + '-' + str(when[0]) + '-' + str(when[1])
 
@@ -240,9 +256,9 @@ def renew_cache(cx, machine, direction, prefix, when, fetch):
     new_rows = len(rows)
     print('found ' + str(new_rows) + ' rows in ' + diff)
 
-    update_cache(cx, direction, name, when, rows)
+    update_cache(cx, direction, manifest, prefix, when, rows)
 
-def perform_update(cx, machine, direction, prefix, fetch):
+def perform_update(cx, machine, direction, manifest, prefix, fetch):
     # Fetch the actual data.
     metadata = load_metadata(prefix)
     last_stamp = metadata['last_stamp']
@@ -284,19 +300,22 @@ def perform_update(cx, machine, direction, prefix, fetch):
         name = prefix + '-' + str(when[0]) + '-' + str(when[1])
 
         with Profiler() as p:
-            if not update_cache(cx, direction, name, when, data):
-                renew_cache(cx, machine, direction, prefix, when, fetch)
+            if not update_cache(cx, direction, manifest, prefix, when, data):
+                renew_cache(cx, machine, direction, manifest, prefix, when, fetch)
             diff = p.time()
         sys.stdout.write('Updating cache for ' + name + '...')
         sys.stdout.flush()
         print('took ' + diff)
 
+    manifest.save()
     metadata['last_stamp'] = current_stamp
     save_metadata(prefix, metadata)
 
     return new_rows
 
-def update(cx, machine, suite):
+# Returns (prefix, direction, fetch) for the suite itself, followed by all its
+# subtests.
+def suite_series(machine, suite):
     def fetch_aggregate(machine, finish_stamp = (0,"UNIX_TIMESTAMP()"), approx_stamp = (0,"UNIX_TIMESTAMP()")):
         return fetch_suite_scores(machine.id, suite.id, finish_stamp, approx_stamp)
 
@@ -304,26 +323,33 @@ def update(cx, machine, suite):
     if suite.visible == 2:
         prefix = "auth-"
 
-    prefix += 'raw-' + suite.name + '-' + str(machine.id)
-    new_rows = perform_update(cx, machine, suite.direction, prefix, fetch_aggregate)
-
-    # This is a little cheeky, but as an optimization we don't bother querying
-    # subtests if we didn't find new rows.
-    if not new_rows:
-        return
+    series = [(prefix + 'raw-' + suite.name + '-' + str(machine.id), suite.direction, fetch_aggregate)]
 
     for subtest in suite.tests:
-        def fetch_test(machine, finish_stamp = (0,"UNIX_TIMESTAMP()"), approx_stamp = (0,"UNIX_TIMESTAMP()")):
+        def fetch_test(machine, finish_stamp = (0,"UNIX_TIMESTAMP()"), approx_stamp = (0,"UNIX_TIMESTAMP()"), subtest=subtest):
             return fetch_test_scores(machine.id, suite.id, subtest.name, finish_stamp, approx_stamp)
 
-        prefix = ""
-        if suite.visible == 2:
-            prefix = "auth-"
-
         direction = suite.direction if subtest.direction == 0 else subtest.direction
 
-        prefix += 'bk-raw-' + suite.name + '-' + subtest.name + '-' + str(machine.id)
-        perform_update(cx, machine, direction, prefix, fetch_test)
+        series.append((prefix + 'bk-raw-' + suite.name + '-' + subtest.name + '-' + str(machine.id),
+                       direction, fetch_test))
+
+    return series
+
+def update(cx, machine, suite):
+    manifest = Manifest(machine.id, suite.name)
+
+    series = suite_series(machine, suite)
+    prefix, direction, fetch = series[0]
+    new_rows = perform_update(cx, machine, direction, manifest, prefix, fetch)
+
+    # This is a little cheeky, but as an optimization we don't bother querying
+    # subtests if we didn't find new rows.
+    if not new_rows:
+        return
+
+    for prefix, direction, fetch in series[1:]:
+        perform_update(cx, machine, direction, manifest, prefix, fetch)
 
 def export_master(cx):
     j = { "version": awfy.version,
@@ -0,0 +1,203 @@
+"""
+Local store of downloaded builds.
+
+Every build gets extracted once into <store>/<key>/, where the key is a hash
+of the url it was downloaded from and the platform. Output folders are
+hardlinked from there, so retriggers, bisections and runs of several
+configs don't download and extract the same build again.
+
+index.json keeps the size and last use of every build, and maps the
+revisions of known builds to their key (see alias()). That way a revision
+that was downloaded before doesn't even need to be resolved to an url. When
+the store grows over its budget, the least recently used builds are removed.
+
+Prefetches and downloads use the store from several processes at once, so
+index.json is only read and written while holding a lock on index.lock.
+"""
+
+import contextlib
+import errno
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+
+DefaultFolder = "artifacts"
+DefaultBudget = 10 # GB
+
+def key(url, platform):
+    return hashlib.sha1(url + "\0" + platform).hexdigest()
+
+def alias(repo, revision, buildtype, platform):
+    return "/".join([repo, revision, buildtype, platform])
+
+def folder_size(path):
+    size = 0
+    for root, dirs, files in os.walk(path):
+        for name in files:
+            size += os.lstat(os.path.join(root, name)).st_size
+    return size
+
+def link_tree(source, target):
+    """
+    Recreates the tree at source in target, hardlinking the files. Falls back
+    to copying when target is on another filesystem.
+    """
+    for root, dirs, files in os.walk(source):
+        dest = os.path.join(target, os.path.relpath(root, source))
+        if not os.path.isdir(dest):
+            os.makedirs(dest)
+        for name in files + [name for name in dirs if os.path.islink(os.path.join(root, name))]:
+            src = os.path.join(root, name)
+            dst = os.path.join(dest, name)
+            if os.path.islink(src):
+                os.symlink(os.readlink(src), dst)
+                continue
+            try:
+                os.link(src, dst)
+            except OSError as e:
+                if e.errno != errno.EXDEV:
+                    raise
+                shutil.copy2(src, dst)
+
+class Store(object):
+    def __init__(self, folder=DefaultFolder, budget=DefaultBudget):
+        self.folder = folder
+        self.budget = budget * 1024 ** 3
+        self.index_file = os.path.join(folder, "index.json")
+        # Builds can be downloaded on several threads at once.
+        self.lock = threading.RLock()
+
+        self.builds = {}
+        self.aliases = {}
+
+    @contextlib.contextmanager
+    def locked(self):
+        """
+        Locks the index against other threads and processes, and loads the
+        latest version of it.
+        """
+        with self.lock:
+            if not os.path.isdir(self.folder):
+                os.makedirs(self.folder)
+            with open(os.path.join(self.folder, "index.lock"), "w") as fp:
+                fcntl.flock(fp, fcntl.LOCK_EX)
+                try:
+                    self.load()
+                    yield
+                finally:
+                    fcntl.flock(fp, fcntl.LOCK_UN)
+
+    def load(self):
+        self.builds = {}
+        self.aliases = {}
+        if os.path.exists(self.index_file):
+            with open(self.index_file, "r") as fp:
+                index = json.load(fp)
+            self.builds = index["builds"]
+            self.aliases = index["aliases"]
+
+    def save(self):
+        with open(self.index_file + ".tmp", "w") as fp:
+            json.dump({ "builds": self.builds, "aliases": self.aliases }, fp, indent=2)
+        os.rename(self.index_file + ".tmp", self.index_file)
+
+    def path(self, key):
+        return os.path.join(self.folder, key)
+
+    def lookup(self, alias):
+        with self.locked():
+            key = self.aliases.get(alias)
+            if self.has(key):
+                return key
+            return None
+
+    def has(self, key):
+        return key in self.builds and os.path.isdir(self.path(key))
+
+    def materialize(self, key, folder):
+        """
+        Hardlinks the build into folder and rewrites info.json with the paths
+        in folder. Returns False when the build isn't in the store.
+        """
+        with self.locked():
+            return self._materialize(key, folder)
+
+    def _materialize(self, key, folder):
+        if not self.has(key):
+            return False
+
+        print "Using build", key, "from the artifact store"
+        if os.path.isdir(folder):
+            shutil.rmtree(folder)
+        link_tree(self.path(key), folder)
+
+        # info.json holds absolute paths, so it can't be shared.
+        info_file = os.path.join(folder, "info.json")
+        os.unlink(info_file)
+        with open(os.path.join(self.path(key), "info.json"), "r") as fp:
+            info = json.load(fp)
+        for name in ["binary", "folder"]:
+            if name in info:
+                info[name] = os.path.abspath(os.path.join(folder, info[name]))
+        with open(info_file, "w") as fp:
+            json.dump(info, fp)
+
+        self.builds[key]["last_used"] = time.time()
+        self.save()
+        return True
+
+    def add(self, key, folder, aliases=[]):
+        """
+        Stores the downloaded build in folder under key.
+        """
+        with self.locked():
+            self._add(key, folder, aliases)
+
+    def _add(self, key, folder, aliases):
+        tmp = self.path(key) + ".tmp"
+        if os.path.isdir(tmp):
+            shutil.rmtree(tmp)
+        link_tree(folder, tmp)
+
+        # Keep the paths in info.json relative to the build.
+        with open(os.path.join(folder, "info.json"), "r") as fp:
+            info = json.load(fp)
+        for name in ["binary", "folder"]:
+            if name in info:
+                info[name] = os.path.relpath(info[name], os.path.abspath(folder))
+        os.unlink(os.path.join(tmp, "info.json"))
+        with open(os.path.join(tmp, "info.json"), "w") as fp:
+            json.dump(info, fp)
+
+        if os.path.isdir(self.path(key)):
+            shutil.rmtree(self.path(key))
+        os.rename(tmp, self.path(key))
+
+        self.builds[key] = { "size": folder_size(self.path(key)),
+                             "last_used": time.time(),
+                             "revision": info.get("revision") }
+        for alias in aliases:
+            self.aliases[alias] = key
+        self.evict(keep=key)
+        self.save()
+
+    def evict(self, keep=None):
+        total = sum(build["size"] for build in self.builds.values())
+        by_age = sorted(self.builds, key=lambda key: self.builds[key]["last_used"])
+        for key in by_age:
+            if total <= self.budget:
+                break
+            if key == keep:
+                continue
+            print "Evicting build", key, "from the artifact store"
+            if os.path.isdir(self.path(key)):
+                shutil.rmtree(self.path(key))
+            total -= self.builds.pop(key)["size"]
+
+        for alias, key in self.aliases.items():
+            if key not in self.builds:
+                del self.aliases[alias]
@@ -36,15 +36,12 @@ class Benchmark:
             host = utils.config.get('main', 'serverUrl')
             if host[-1] != "/":
                 host += "/"
-            engine.run(host + self.page, mode_info)
-
-            timeout = self.timeout * 60
-            while not os.path.exists("results") and timeout > 0:
-                time.sleep(10)
-                timeout -= 10
+            with utils.ResultsListener() as listener:
+                engine.run(host + self.page, mode_info)
+                captured = utils.wait_for_file("results", self.timeout * 60, listener)
             engine.kill()
 
-            if timeout <= 0:
+            if not captured:
                 print "Running benchmark timed out"
                 continue
 
@@ -0,0 +1,234 @@
+#!/usr/bin/env python2
+
+"""
+Bisects a regression between two runs.
+
+    python bisection.py --repo mozilla-inbound --good <rev> --bad <rev> \
+                        --good-run <id> --bad-run <id> -b remote.octane -c default \
+                        --mode jmim -m <machine>
+
+Every round picks k pushes evenly spread over the interval that is left and
+downloads their builds concurrently. Builds go through the artifact store,
+so revisions that were seen before aren't downloaded again. Only the given
+benchmark runs on them, one after another, and every result gets submitted
+as an out-of-order run between the runs of its neighbours. The next round
+continues on the pair of neighbouring pushes with the largest step in score,
+until that pair is two consecutive pushes.
+"""
+
+import json
+import os
+import shutil
+import sys
+
+from multiprocessing.pool import ThreadPool
+from optparse import OptionParser
+
+import artifacts
+import benchmarks
+import configs
+import download
+import engineInfo
+import executors
+import staging
+import submitter
+import url_creator
+import utils
+
+BisectFolder = "bisect"
+
+# Location of the repositories on hg.mozilla.org.
+HgRepos = {
+    "mozilla-inbound": "integration/mozilla-inbound",
+    "mozilla-autoland": "integration/autoland",
+    "mozilla-central": "mozilla-central",
+    "mozilla-beta": "releases/mozilla-beta",
+    "mozilla-release": "releases/mozilla-release",
+}
+
+def push_heads(repo, good, bad):
+    """
+    Returns the last changeset of every push after good, up to bad.
+    """
+    if repo not in HgRepos:
+        raise Exception("Can only bisect " + ", ".join(sorted(HgRepos)))
+
+    url = "https://hg.mozilla.org/{}/json-pushes?fromchange={}&tochange={}".format(
+              HgRepos[repo], good, bad)
+    # The pushes between two revisions don't change.
+    pushes = json.loads(url_creator.fetch(url, None))
+    ids = sorted(pushes, key=int)
+    return [pushes[id]["changesets"][-1] for id in ids]
+
+def pick(candidates, k):
+    """
+    Returns k of the candidates, evenly spread.
+    """
+    if len(candidates) <= k:
+        return list(candidates)
+    step = float(len(candidates) + 1) / (k + 1)
+    indexes = sorted(set(int(round(step * (i + 1))) - 1 for i in range(k)))
+    return [candidates[index] for index in indexes]
+
+def output_folder(revision):
+    return os.path.join(BisectFolder, revision)
+
+def fetch(revisions, arch, repo, buildtype, store):
+    """
+    Downloads the builds of these revisions concurrently. Returns the
+    revisions that have a build.
+    """
+    def get(revision):
+        try:
+            downloader = download.download_for_repo(arch, repo, revision, buildtype, store)
+            downloader.set_output_folder(output_folder(revision))
+            downloader.download()
+            return revision, True
+        except Exception as e:
+            print "No build for", revision + ":", repr(e)
+            return revision, False
+
+    pool = ThreadPool(min(url_creator.MaxWorkers, len(revisions)))
+    try:
+        found = dict(pool.map(get, revisions))
+    finally:
+        pool.close()
+        pool.join()
+    return [revision for revision in revisions if found[revision]]
+
+def score(results):
+    for test in results:
+        if test["name"] == "__total__":
+            return float(test["time"])
+    return None
+
+def step(a, b):
+    return abs(b - a) / max(min(abs(a), abs(b)), 1e-9)
+
+class Bisection(object):
+    def __init__(self, options, log):
+        self.options = options
+        self.log = log
+        self.benchmark = benchmarks.get(options.benchmark)
+        self.store = artifacts.Store()
+        self.scores = {}
+        self.runs = { options.good: options.good_run, options.bad: options.bad_run }
+
+        self.submitter = submitter.get_submitter(options.submitter)
+        if options.machine:
+            self.submitter.set_machine(options.machine)
+
+    def measure(self, revision):
+        info = engineInfo.read_info_file(output_folder(revision))
+        config = configs.getConfig(self.options.config, info)
+        executor = executors.make_executor(info)
+        self.log("Running {} on {}...".format(self.benchmark.version, revision))
+        results = executor.run(self.benchmark, config)
+        utils.flush()
+        return info, results
+
+    def submit(self, revision, info, results, before, after):
+        self.submitter.set_mode_rules([info["engine_type"] + "," + self.options.config +
+                                       ":" + self.options.mode])
+        self.submitter.start_out_of_order(self.options.mode, revision,
+                                          self.runs[before], self.runs[after])
+        self.submitter.create_build(info["engine_type"], self.options.config, revision)
+        self.submitter.add_tests(results, self.benchmark.suite, self.benchmark.version,
+                                 self.options.mode, "bisect")
+        self.submitter.finish()
+
+        # Without a run the next results get placed between the runs further
+        # out.
+        if self.submitter.runIds[0] is None:
+            self.log("No run was created for " + revision)
+            return
+        self.runs[revision] = self.submitter.runIds[0]
+
+    def neighbour_run(self, revisions, revision, direction):
+        index = revisions.index(revision)
+        neighbours = revisions[index + 1:] if direction > 0 else reversed(revisions[:index])
+        return next(r for r in neighbours if r in self.runs)
+
+    def run(self):
+        options = self.options
+        heads = push_heads(options.repo, options.good, options.bad)
+        revisions = [options.good] + heads[:-1] + [options.bad]
+        self.log("{} pushes between {} and {}".format(len(revisions) - 2, options.good, options.bad))
+
+        # The ends already have runs, they only get measured on this machine
+        # to compare against.
+        todo = [options.good, options.bad]
+        while True:
+            for revision in fetch(todo, options.arch, options.repo, options.buildtype, self.store):
+                info, results = self.measure(revision)
+                if not results:
+                    continue
+                self.scores[revision] = score(results)
+                if revision not in self.runs:
+                    self.submit(revision, info, results,
+                                self.neighbour_run(revisions, revision, -1),
+                                self.neighbour_run(revisions, revision, 1))
+
+            # Pushes without a build or results can't tell anything.
+            revisions = [r for r in revisions if r not in todo or self.scores.get(r) is not None]
+            measured = [r for r in revisions if self.scores.get(r) is not None]
+            if options.good not in measured or options.bad not in measured:
+                self.log("Couldn't measure both the good and the bad revision.")
+                return None
+
+            pairs = zip(measured, measured[1:])
+            good, bad = max(pairs, key=lambda pair: step(self.scores[pair[0]], self.scores[pair[1]]))
+            self.log("Largest step: {} ({}) -> {} ({})".format(good, self.scores[good],
+                                                                bad, self.scores[bad]))
+            todo = pick(revisions[revisions.index(good) + 1:revisions.index(bad)], options.k)
+            if not todo:
+                self.log("Regression in the push of " + bad)
+                return bad
+
+if __name__ == "__main__":
+    parser = OptionParser(usage="usage: %prog [options]")
+    parser.add_option("-r", "--repo", dest="repo",
+                      help="The repository to bisect, e.g. mozilla-inbound")
+    parser.add_option("--good", dest="good", help="Revision without the regression")
+    parser.add_option("--bad", dest="bad", help="Revision with the regression")
+    parser.add_option("--good-run", dest="good_run", type="int",
+                      help="Id of the run of the good revision")
+    parser.add_option("--bad-run", dest="bad_run", type="int",
+                      help="Id of the run of the bad revision")
+    parser.add_option("-b", "--benchmark", dest="benchmark",
+                      help="The benchmark that regressed, e.g. remote.octane")
+    parser.add_option("-c", "--config", dest="config", default="default",
+                      help="The runtime config to run with, default=default")
+    parser.add_option("--mode", dest="mode",
+                      help="The mode to submit the results to, e.g. jmim")
+    parser.add_option("-s", "--submitter", dest="submitter", default="remote",
+                      help="Submitter class ('remote' or 'print'), default=remote")
+    parser.add_option("-m", "--machine", dest="machine", type="int",
+                      help="The machine number to submit to")
+    parser.add_option("-k", dest="k", type="int", default=3,
+                      help="Number of pushes to try per round, default=3")
+    parser.add_option("--arch", dest="arch", default="64bit",
+                      help="32bit or 64bit builds, default=64bit")
+    parser.add_option("--buildtype", dest="buildtype", default="opt",
+                      help="Build type to use (opt, debug, pgo), default=opt")
+    (options, args) = parser.parse_args()
+
+    for name in ["repo", "good", "bad", "good_run", "bad_run", "benchmark", "mode"]:
+        if getattr(options, name) is None:
+            parser.print_help()
+            exit("Please provide --" + name.replace("_", "-"))
+
+    utils.config.init("awfy.config")
+    utils.log_banner("BISECT")
+    log = utils.make_log("BISECT")
+
+    try:
+        with utils.AutoSpawnServer(log):
+            culprit = Bisection(options, log).run()
+    finally:
+        staging.prune()
+        if os.path.isdir(BisectFolder):
+            shutil.rmtree(BisectFolder)
+
+    if not culprit:
+        sys.exit(1)
@@ -3,9 +3,13 @@
 import json
 import urllib
 import os
+import re
 import shutil
 import socket
 import platform
+import time
+
+from distutils.spawn import find_executable
 
 import utils
 from utils import Run
@@ -14,6 +18,25 @@ import puller
 
 socket.setdefaulttimeout(120)
 
+CompilerCaches = ["sccache", "ccache"]
+
+# Patterns of the hit and miss counts in the statistics of the compiler
+# caches, per format. Old ccache lists the hits per kind, new ccache and
+# sccache in total.
+CacheHitPatterns = [[r"^cache hit \(direct\)\s+(\d+)", r"^cache hit \(preprocessed\)\s+(\d+)"],
+                    [r"^\s*Hits:\s+(\d+)"],
+                    [r"^Cache hits\s+(\d+)\s*$"]]
+CacheMissPatterns = [[r"^cache miss\s+(\d+)"],
+                     [r"^\s*Misses:\s+(\d+)"],
+                     [r"^Cache misses\s+(\d+)\s*$"]]
+
+def count(formats, output):
+    for patterns in formats:
+        found = [re.search(pattern, output, re.MULTILINE) for pattern in patterns]
+        if any(found):
+            return sum(int(match.group(1)) for match in found if match)
+    return 0
+
 class Environment(object):
     def __init__(self):
         self.env_ = os.environ.copy()
@@ -21,18 +44,60 @@ class Environment(object):
         self.add("CXX", "g++")
         self.add("LINK", "g++")
         self.ccoption = []
+        self.compiler_cache = None
+
+    def setCompilerCache(self, name, size, folder):
+        """
+        Wraps the compilers with ccache or sccache. 'auto' picks whichever
+        is installed. folder is the root of the checkout that gets built.
+        """
+        if name == "auto":
+            name = next((cache for cache in CompilerCaches if find_executable(cache)), None)
+        if not name or name == "none":
+            return
+
+        self.compiler_cache = find_executable(name)
+        if not self.compiler_cache:
+            raise Exception("Couldn't find " + name)
+
+        if name == "sccache":
+            self.add("SCCACHE_CACHE_SIZE", size)
+            self.add("RUSTC_WRAPPER", self.compiler_cache)
+        else:
+            self.add("CCACHE_MAXSIZE", size)
+            # Paths in the checkout become relative, so checkouts of other
+            # revisions in other folders share the cache.
+            self.add("CCACHE_BASEDIR", os.path.realpath(folder))
+
+    def cacheName(self):
+        return os.path.basename(self.compiler_cache)
+
+    def zeroCacheStats(self):
+        if self.compiler_cache:
+            Run([self.compiler_cache, "--zero-stats"], self.get(), silent=True)
+
+    def cacheStats(self):
+        """
+        Returns the number of cache hits and misses since zeroCacheStats.
+        """
+        output = Run([self.compiler_cache, "--show-stats"], self.get(), silent=True)
+        return count(CacheHitPatterns, output), count(CacheMissPatterns, output)
 
     def add(self, name, data):
         self.env_[name] = data
 
     def remove(self, name):
-        del self.env_[name]
+        self.env_.pop(name, None)
 
     def addCCOption(self, option):
         self.ccoption.append(option)
 
     def get(self):
         env = self.env_.copy()
+        if self.compiler_cache:
+            for name in ["CC", "CXX"]:
+                if name in env and not env[name].startswith(self.compiler_cache):
+                    env[name] = self.compiler_cache + " " + env[name]
         if len(self.ccoption) > 0:
             env["CC"] += " " + " ".join(self.ccoption)
             env["CXX"] += " " + " ".join(self.ccoption)
@@ -95,22 +160,34 @@ class Builder(object):
     def successfullyBuild(self):
         return os.path.isfile(self.binary())
 
-    def reconf(self):
+    def reconf(self, clobber=False):
         return
 
     def build(self, puller):
         self.unlinkBinary()
+        self.env.zeroCacheStats()
+        start = time.time()
 
         try:
             self.make()
         except:
             pass
 
+        # Reconfigure in the existing objdir first, so the objects that are
+        # still valid don't get built again. Only start over when that fails.
         if not self.successfullyBuild():
-            self.reconf()
+            try:
+                self.reconf()
+                self.make()
+            except:
+                pass
+
+        if not self.successfullyBuild():
+            self.reconf(clobber=True)
             self.make()
 
         assert self.successfullyBuild()
+        stats = self.report(time.time() - start)
 
         info = self.retrieve_info()
         info["revision"] = puller.identify()
@@ -118,6 +195,7 @@ class Builder(object):
         if 'shell' not in info:
             info["shell"] = True
         info["binary"] = os.path.abspath(self.binary())
+        info["build"] = stats
 
         fp = open(os.path.join(self.folder, "info.json"), "w")
         json.dump(info, fp)
@@ -125,6 +203,18 @@ class Builder(object):
 
         print "Build done!"
 
+    def report(self, duration):
+        stats = { "duration": int(duration) }
+        message = "Build took {}s".format(int(duration))
+        if self.env.compiler_cache:
+            hits, misses = self.env.cacheStats()
+            stats.update({ "cache": self.env.cacheName(), "cache_hits": hits, "cache_misses": misses })
+            if hits + misses > 0:
+                message += ", {}: {} hits, {} misses ({:.1f}% hit rate)".format(
+                    self.env.cacheName(), hits, misses, 100.0 * hits / (hits + misses))
+        print message
+        return stats
+
 class MozillaBuilder(Builder):
     def __init__(self, config, folder):
         super(MozillaBuilder, self).__init__(config, folder);
@@ -143,12 +233,13 @@ class MozillaBuilder(Builder):
         return info
 
     def objdir(self):
-        return os.path.join(self.folder, 'js', 'src', 'Opt')
+        # One objdir per config, so switching configs doesn't rebuild all.
+        return os.path.join(self.folder, 'js', 'src', 'Opt-' + self.config)
 
     def binary(self):
         return os.path.join(self.objdir(), 'dist', 'bin', 'js')
 
-    def reconf(self):
+    def reconf(self, clobber=False):
         # Step 0. install ndk if needed.
         if self.config.startswith("android"):
             self.env.remove("CC")
@@ -166,9 +257,10 @@ class MozillaBuilder(Builder):
                 utils.run_realtime("autoconf-2.13", shell=True)
 
         # Step 2. configure
-        if os.path.exists(os.path.join(self.folder, 'js', 'src', 'Opt')):
-            shutil.rmtree(os.path.join(self.folder, 'js', 'src', 'Opt'))
-        os.mkdir(os.path.join(self.folder, 'js', 'src', 'Opt'))
+        if clobber and os.path.exists(self.objdir()):
+            shutil.rmtree(self.objdir())
+        if not os.path.exists(self.objdir()):
+            os.mkdir(self.objdir())
         args = ['--enable-optimize', '--disable-debug']
         if self.config == "android":
             args.append("--target=arm-linux-androideabi")
@@ -188,14 +280,14 @@ class MozillaBuilder(Builder):
             else:
                 assert False
 
-        with utils.chdir(os.path.join(self.folder, 'js', 'src', 'Opt')):
+        with utils.chdir(self.objdir()):
             Run(['../configure'] + args, self.env.get())
         return True
 
     def make(self):
-        if not os.path.exists(os.path.join(self.folder, 'js', 'src', 'Opt')):
+        if not os.path.exists(self.objdir()):
             return
-        utils.run_realtime("make -j6 -C " + os.path.join(self.folder, 'js', 'src', 'Opt'), shell=True)
+        utils.run_realtime("make -j6 -C " + self.objdir(), shell=True)
 
 class WebkitBuilder(Builder):
     def retrieve_info(self):
@@ -288,6 +380,9 @@ class V8Builder(Builder):
                 'target_cpu = "{}"'.format(target_cpu)
             ]
 
+            if self.env.compiler_cache:
+                config.append('cc_wrapper = "{}"'.format(self.env.compiler_cache))
+
             if self.config == "arm":
                 config += [
                     'symbol_level = 1',
@@ -365,6 +460,15 @@ if __name__ == "__main__":
     parser.add_option("-c", "--config", dest="config",
                       help="auto, 32bit, 64bit, android, android64", default='auto')
 
+    parser.add_option("--mirrors", dest="mirrors", metavar="DIR",
+                      help="Keep a shared mirror of the repo in DIR and check the revision out in the output folder from there, so several revisions can be built at once")
+
+    parser.add_option("--compiler-cache", dest="compiler_cache", default="none",
+                      help="Compiler cache to build with: ccache, sccache, none or auto (whichever is installed), default=none")
+
+    parser.add_option("--cache-size", dest="cache_size", default="20G",
+                      help="Maximum size of the compiler cache, default=20G")
+
     parser.add_option("-f", "--force", dest="force", action="store_true", default=False,
                       help="Force runs even without source changes")
 
@@ -388,10 +492,11 @@ if __name__ == "__main__":
         print "Cannot compile a 64bit binary on 32bit architecture"
         exit()
 
-    puller = puller.getPuller(options.repo, options.output)
+    puller = puller.getPuller(options.repo, options.output, options.mirrors)
     puller.update(options.revision)
 
     builder = getBuilder(options.config, options.output)
+    builder.env.setCompilerCache(options.compiler_cache, options.cache_size, builder.folder)
     if options.force:
         builder.unlinkObjdir()
     builder.build(puller)
@@ -8,7 +8,7 @@ import shutil
 import socket
 import sys
 import tarfile
-import urllib
+import time
 import urllib2
 import zipfile
 
@@ -16,6 +16,8 @@ from optparse import OptionParser
 
 socket.setdefaulttimeout(120)
 
+import artifacts
+import prefetch
 import url_creator
 import utils
 
@@ -44,8 +46,17 @@ def download_from_url(url):
 
     raise Exception("Unknown retriever")
 
-def download_for_repo(config, repo, cset="latest", buildtype='opt'):
+def download_for_repo(config, repo, cset="latest", buildtype='opt', store=None):
     print "Downloading for repository {}".format(repo, cset)
+
+    # A known revision doesn't need to get resolved again.
+    alias = None
+    if store and cset != "latest":
+        alias = artifacts.alias(repo, cset, buildtype, config)
+        key = store.lookup(alias)
+        if key:
+            return StoredDownloader(store, key)
+
     creator = url_creator.get(config, repo)
 
     urls = creator.find(cset, buildtype=buildtype)
@@ -53,12 +64,61 @@ def download_for_repo(config, repo, cset="latest", buildtype='opt'):
         print "trying: " + url
         downloader = download_from_url(url)
         if downloader.valid():
+            downloader.set_store(store, config, [alias] if alias else [])
             return downloader
 
     raise Exception("couldn't find the revision.")
 
+class ProgressReader(object):
+    """
+    File-like wrapper around a response, which reports the progress and
+    throughput while it is being read.
+    """
+
+    def __init__(self, fp, total=None, interval=5):
+        self.fp = fp
+        self.total = int(total) if total else None
+        self.interval = interval
+        self.bytes = 0
+        self.start = time.time()
+        self.last = self.start
+
+    def read(self, size=-1):
+        prefetch.pause_point()
+        data = self.fp.read(size)
+        self.bytes += len(data)
+
+        now = time.time()
+        if now - self.last >= self.interval:
+            self.last = now
+            self.report()
+        return data
+
+    def throughput(self):
+        return self.bytes / max(time.time() - self.start, 0.001) / 1e6
+
+    def report(self):
+        progress = "{:.1f} MB".format(self.bytes / 1e6)
+        if self.total:
+            progress += " of {:.1f} MB ({:.0f}%)".format(self.total / 1e6,
+                                                      100.0 * self.bytes / self.total)
+        print "Downloaded {}, {:.1f} MB/s".format(progress, self.throughput())
+
+    def finish(self):
+        print "Downloaded {:.1f} MB in {:.1f}s, {:.1f} MB/s".format(
+            self.bytes / 1e6, time.time() - self.start, self.throughput())
+
 class Downloader(object):
 
+    # Extract tarballs while they are being downloaded, instead of writing
+    # them to disk first.
+    stream = True
+    streamed = False
+
+    store = None
+    platform = None
+    aliases = []
+
     def __init__(self, url):
         if not url.endswith("/"):
             url += "/"
@@ -74,12 +134,28 @@ class Downloader(object):
             folder += "/"
         self.folder = folder
 
-    def download(self):
-        self.create_output_folder()
+    def set_store(self, store, platform, aliases=[]):
+        """
+        Keep builds in the artifact store. platform is the config the build
+        was downloaded for, aliases are the revisions it is known under.
+        """
+        self.store = store
+        self.platform = platform
+        self.aliases = aliases
 
+    def download(self):
         filename = self.get_filename()
         assert filename
+
+        key = None
+        if self.store:
+            key = artifacts.key(self.url + filename, self.platform)
+            if self.store.materialize(key, self.folder):
+                return
+
+        self.create_output_folder()
         self.retrieve(filename)
+        prefetch.pause_point()
         self.extract(filename)
 
         info = self.retrieve_info()
@@ -87,6 +163,10 @@ class Downloader(object):
         json.dump(info, fp)
         fp.close()
 
+        if self.store:
+            prefetch.pause_point()
+            self.store.add(key, self.folder, self.aliases)
+
     def create_output_folder(self):
         if os.path.isdir(self.folder):
             shutil.rmtree(self.folder)
@@ -94,9 +174,25 @@ class Downloader(object):
 
     def retrieve(self, filename):
         print "Retrieving", self.url + filename
-        urllib.urlretrieve(self.url + filename, self.folder + filename)
+        response = urllib2.urlopen(self.url + filename)
+        reader = ProgressReader(response, response.info().getheader("Content-Length"))
+
+        # Zip files keep their index at the end, so they can't be extracted
+        # before they are completely downloaded.
+        if self.stream and "tar.bz2" in filename:
+            tar = tarfile.open(fileobj=reader, mode="r|bz2")
+            tar.extractall(self.folder)
+            tar.close()
+            self.streamed = True
+        else:
+            with open(self.folder + filename, "wb") as fp:
+                shutil.copyfileobj(reader, fp, 1024 * 1024)
+        reader.finish()
 
     def extract(self, filename):
+        if self.streamed:
+            return
+
         if "tar.bz2" in filename:
             tar = tarfile.open(self.folder + filename)
             tar.extractall(self.folder)
@@ -105,6 +201,24 @@ class Downloader(object):
             with utils.chdir(self.folder):
                 utils.Run(["unzip", filename], silent=True)
 
+class StoredDownloader(Downloader):
+    """
+    Materializes a build from the artifact store, without going to the
+    network.
+    """
+
+    def __init__(self, store, key):
+        self.store = store
+        self.key = key
+        self.folder = "./"
+
+    def valid(self):
+        return True
+
+    def download(self):
+        if not self.store.materialize(self.key, self.folder):
+            raise Exception("Build " + self.key + " is no longer in the artifact store")
+
 class TreeherderDownloader(Downloader):
 
     def __init__(self, url):
@@ -349,6 +463,16 @@ if __name__ == "__main__":
     parser.add_option("-b", "--buildtype", dest="buildtype",
                       help="Specify build type to use (opt, debug, pgo). The default is 'opt'.",
                       default="opt")
+    parser.add_option("--no-stream", dest="stream", action="store_false", default=True,
+                      help="Write archives to disk before extracting them.")
+    parser.add_option("--artifact-store", dest="artifact_store", metavar="DIR",
+                      help="Keep downloaded builds in DIR and reuse them, default=artifacts/",
+                      default=artifacts.DefaultFolder)
+    parser.add_option("--artifact-budget", dest="artifact_budget", type="float", metavar="GB",
+                      help="Disk space the artifact store may use, default={}".format(artifacts.DefaultBudget),
+                      default=artifacts.DefaultBudget)
+    parser.add_option("--no-artifact-store", dest="artifact_store", action="store_const", const=None,
+                      help="Always download builds.")
     (options, args) = parser.parse_args()
 
     if ((sys.version_info.major < 2) or
@@ -372,15 +496,25 @@ if __name__ == "__main__":
     if os.path.exists(os.path.join(options.output, "info.json")):
         os.remove(os.path.join(options.output, "info.json"))
 
+    # A build that is being prefetched ends up in the store, don't download
+    # it twice.
+    prefetch.wait(sys.argv[1:])
+
+    store = None
+    if options.artifact_store:
+        store = artifacts.Store(options.artifact_store, options.artifact_budget)
+
     if options.url:
         downloader = download_from_url(options.url)
+        downloader.set_store(store, options.config)
     elif options.repo:
         downloader = download_for_repo(options.config, options.repo,
-                                       options.cset, options.buildtype)
+                                       options.cset, options.buildtype, store)
     else:
         raise Exception("You'll need to specify at least an url or repo")
 
     downloader.set_output_folder(options.output)
+    downloader.stream = options.stream
 
     print("Starting download...")
     downloader.download()
@@ -1,8 +1,9 @@
 #!/usr/bin/env python2
 
 import json
-import subprocess
+import shlex
 import sys
+import time
 import traceback
 
 from optparse import OptionParser
@@ -11,6 +12,10 @@ import benchmarks
 import configs
 import engineInfo
 import executors
+import lanes
+import planner
+import prefetch
+import staging
 import submitter
 import utils
 
@@ -40,6 +45,18 @@ parser.add_option("-e", "--engine", action="append", dest="engines",
 parser.add_option("-c", "--config", action="append", dest="configs",
                   help="The runtime configs that need to get executed: default, unboxedobjects, turbofan, noasmjs")
 
+parser.add_option("--proxy-mode", dest="proxy_mode", type="string",
+                  help="How the proxy handles remote benchmarks: cache (default), record or replay")
+
+parser.add_option("--lanes", dest="lanes", type="int",
+                  help="Number of shell benchmarks to run concurrently, each pinned to its own cpus (default: 1)")
+
+parser.add_option("--prefetch", action="append", dest="prefetch", metavar="OPTIONS",
+                  help="download.py options of a build the next run needs, e.g. \"--repo mozilla-inbound -r <cset>\". It gets downloaded in the background while this run benchmarks. Can be given multiple times.")
+
+parser.add_option("--dry-run", action="store_true", dest="dry_run", default=False,
+                  help="Print the order the benchmarks would run in and the predicted wall time")
+
 (options, args) = parser.parse_args()
 
 if options.engines is None:
@@ -83,6 +100,25 @@ if options.mode_rules is None:
 #TODO:remove
 utils.config.init("awfy.config")
 
+if options.lanes is None:
+    options.lanes = int(utils.config.getDefault('main', 'lanes', 1))
+
+engines = []
+for engine_path in options.engines:
+    try:
+        engines.append((engine_path, engineInfo.read_info_file(engine_path)))
+    except Exception as e:
+        print('Failed to get info about ' + engine_path + '!')
+        print('Exception: ' +  repr(e))
+        traceback.print_exc(file=sys.stdout)
+
+durations = planner.Durations()
+plan = planner.plan(options.benchmarks, engines, options.configs, options.lanes, durations)
+
+if options.dry_run:
+    print plan.describe()
+    exit()
+
 submitter = submitter.get_submitter(options.submitter)
 submitter.set_mode_rules(options.mode_rules)
 
@@ -97,75 +133,88 @@ else:
     submitter.start()
 
 # Submit the revisions for every build.
-engines = []
-for engine_path in options.engines:
+for engine_path, info in engines:
     try:
-        info = engineInfo.read_info_file(engine_path)
         for config_name in options.configs:
             config = configs.getConfig(config_name, info)
             if config.omit():
                 continue
             submitter.create_build(info["engine_type"], config_name, info["revision"])
-        engines.append(engine_path)
     except Exception as e:
-        print('Failed to get info about ' + engine_path + '!')
+        print('Failed to submit the build of ' + engine_path + '!')
         print('Exception: ' +  repr(e))
         traceback.print_exc(file=sys.stdout)
+        plan.drop(engine_path)
 
-class AutoSpawnServer:
-    def __init__(self, log):
-        self.server = None
-        self.log = log
+def run_job(executor, job):
+    config = configs.getConfig(job.config_name, job.info)
+    try:
+        return executor.run(job.benchmark, config)
+    except Exception as e:
+        log('Failed to run ' + job.engine_path + ' - ' + job.benchmark.version + ' - ' + job.config_name + '!')
+        log('Exception: ' +  repr(e))
+        import traceback
+        traceback.print_exc()
+        return None
+
+def run_lane_job(index):
+    job = plan.laned[index]
+    executor = executors.make_executor(job.info)
 
-    def __enter__(self):
-        self.log("Starting proxy server.")
-        self.server = subprocess.Popen(['python', 'server.py'])
+    start = time.time()
+    results = run_job(executor, job)
+    utils.flush()
+    return index, results, lanes.lane_id, time.time() - start
 
-    def __exit__(self, type, value, traceback):
-        self.log("Terminating proxy server.")
-        if self.server:
-            self.server.terminate()
-            self.server = None
+def submit(job, results, extra_info=""):
+    mode = submitter.mode(job.info["engine_type"], job.config_name)
+    submitter.add_tests(results, job.benchmark.suite, job.benchmark.version, mode, extra_info)
+
+    # Try to preserve order of logs.
+    utils.flush()
 
 if __name__ == '__main__':
     utils.log_banner("EXECUTE")
     log = utils.make_log('EXECUTE')
 
-    with AutoSpawnServer(log):
-        log("Running each benchmark for each config...")
+    # Queue the builds of the next run, they download while this one runs.
+    for args in options.prefetch or []:
+        prefetch.start(shlex.split(args))
 
-        benchmarks = [benchmarks.get(name) for name in options.benchmarks]
-        for benchmark in benchmarks:
-            try:
-                log("now trying to run benchmark %s..." % benchmark.suite)
-            except:
-                pass
-
-            for engine_path in engines:
-                info = engineInfo.read_info_file(engine_path)
-                executor = executors.make_executor(info)
-
-                for config_name in options.configs:
-                    config = configs.getConfig(config_name, info)
-                    if config.omit():
-                        continue
-
-                    try:
-                        results = executor.run(benchmark, config)
-                        if not results:
-                            continue
-                    except Exception as e:
-                        log('Failed to run ' + engine_path + ' - ' + benchmark.version + ' - ' + config_name + '!')
-                        log('Exception: ' +  repr(e))
-                        import traceback
-                        traceback.print_exc()
-                        continue
-
-                    mode = submitter.mode(info["engine_type"], config_name)
-                    submitter.add_tests(results, benchmark.suite, benchmark.version, mode)
-
-                    # Try to preserve order of logs.
-                    utils.flush()
+    with utils.AutoSpawnServer(log, options.proxy_mode):
+        log("Running each benchmark for each config...")
+        log("Predicted wall time: %ds" % plan.predicted_time())
+
+        # Every engine gets one executor, so browsers get installed only once.
+        engine_executors = {}
+
+        try:
+            for job in plan.serial:
+                log("now trying to run %s..." % job.describe())
+                if job.engine_path not in engine_executors:
+                    engine_executors[job.engine_path] = executors.make_executor(job.info)
+
+                start = time.time()
+                with prefetch.paused():
+                    results = run_job(engine_executors[job.engine_path], job)
+                if results:
+                    durations.record(job, time.time() - start)
+                    submit(job, results)
+
+            if plan.laned:
+                log("Running %d shell benchmarks in %d lanes..." % (len(plan.laned), options.lanes))
+                # Lanes run benchmarks all the time, so prefetches stay
+                # paused until all of them are done.
+                with prefetch.paused():
+                    for index, results, lane, duration in lanes.run(run_lane_job, range(len(plan.laned)),
+                                                                    options.lanes):
+                        job = plan.laned[index]
+                        if results:
+                            durations.record(job, duration)
+                            submit(job, results, "lane " + str(lane))
+        finally:
+            durations.save()
+            staging.prune()
 
         if not options.session:
             submitter.finish()
@@ -5,6 +5,10 @@ import time
 
 from mozprofile.profile import FirefoxProfile
 
+import profiles
+import proxy_stats
+import repetition
+import staging
 import utils
 import runners
 
@@ -20,6 +24,8 @@ class ShellExecutor(object):
 
         args = config.args() + self.engineInfo["args"]
         benchmarkDir = os.path.join(utils.config.BenchmarkPath, benchmark.folder())
+        if staging.enabled(self.engineInfo["platform"]):
+            benchmarkDir = staging.stage(benchmarkDir)
 
         return self.execute(benchmarkDir, benchmark, args, env, config)
 
@@ -42,9 +48,13 @@ class ShellExecutor(object):
         return benchmark.process_results(output)
 
 class BrowserExecutor(object):
+    # Last installed binary per platform, as (binary, installed binary).
+    installed = {}
+
     def __init__(self, engineInfo):
         self.engineInfo = engineInfo
         self.benchmark = None
+        self.listener = utils.ResultsListener()
 
     def run(self, benchmark, config):
         self.benchmark = benchmark
@@ -54,7 +64,10 @@ class BrowserExecutor(object):
         env.update(self.engineInfo["env"])
         args = config.args() + self.engineInfo["args"] + [benchmark.url]
 
-        self.execute(benchmark, env, args, config.prefs())
+        # Listen before starting the browser, so no notification gets lost.
+        with self.listener:
+            self.execute(benchmark, env, args, config.prefs())
+        self.save_proxy_stats()
 
         if not os.path.exists("results"):
             return None
@@ -65,26 +78,84 @@ class BrowserExecutor(object):
 
         return benchmark.process_results(results)
 
-    def reset_results(self):
-        if not os.path.exists("results"):
+    def install(self, runner):
+        """
+        Installs the engine, unless it is still installed from the previous
+        benchmark. On OS X the disk image gets unmounted after every run, so
+        it always gets installed again.
+        """
+        platform = self.engineInfo["platform"]
+        previous = BrowserExecutor.installed.get(platform)
+        if platform != "osx" and previous and previous[0] == self.engineInfo["binary"]:
+            print "Already installed:", self.engineInfo["binary"]
+            return previous[1]
+
+        binary = runner.install(self.engineInfo["binary"])
+        BrowserExecutor.installed[platform] = (self.engineInfo["binary"], binary)
+        return binary
+
+    def save_proxy_stats(self):
+        """
+        Stores what the proxy served during this benchmark in proxy-stats,
+        next to the results.
+        """
+        stats = utils.take_proxy_stats()
+        if stats is None:
             return
 
-        os.unlink("results")
+        fp = open("proxy-stats", "w")
+        fp.write(json.dumps(stats))
+        fp.close()
 
-    def wait_for_results(self, timeout):
-        timeout = timeout * 60
+        print "PROXY (executor): " + proxy_stats.format_summary(stats["summary"])
 
-        while not os.path.exists("results") and timeout > 0:
-            time.sleep(10)
-            timeout -= 10
+    def reset_results(self):
+        # Drop whatever the proxy served before this benchmark.
+        utils.take_proxy_stats()
+        if self.benchmark:
+            utils.set_harness_page(self.benchmark.url)
+        if os.path.exists("proxy-stats"):
+            os.unlink("proxy-stats")
 
         if not os.path.exists("results"):
-            suite = ""
-            try:
-                suite = " when running {}".format(self.benchmark.suite)
-            except:
-                pass
-            print "TIMEOUT (executor){}".format(suite)
+            return
+
+        os.unlink("results")
+
+    def wait_for_results(self, timeout, process=None):
+        """
+        Waits until the results are captured. Gives up early when the browser
+        process exits, or when the page stops sending heartbeats after having
+        sent at least one.
+        """
+        end = time.time() + timeout * 60
+        hang_timeout = int(utils.config.getDefault('main', 'hangTimeout', 180))
+        last_heartbeat = None
+
+        suite = ""
+        try:
+            suite = " when running {}".format(self.benchmark.suite)
+        except:
+            pass
+
+        while not os.path.exists("results"):
+            now = time.time()
+            if now >= end:
+                print "TIMEOUT (executor){}".format(suite)
+                return
+
+            if process is not None and process.poll() is not None:
+                # The results could have landed right before the exit.
+                if not os.path.exists("results"):
+                    print "CRASH (executor): browser exited with {}{}".format(process.returncode, suite)
+                return
+
+            if last_heartbeat is not None and now - last_heartbeat > hang_timeout:
+                print "HANG (executor): no progress in {}s{}".format(hang_timeout, suite)
+                return
+
+            if self.listener.wait(min(2, end - now)) == "heartbeat":
+                last_heartbeat = time.time()
 
 class EdgeExecutor(BrowserExecutor):
     def execute(self, benchmark, env, args, prefs):
@@ -129,13 +200,22 @@ class FirefoxExecutor(BrowserExecutor):
         runner.killall("plugin-container")
 
         # if needed install the executable
-        binary = runner.install(self.engineInfo["binary"])
+        binary = self.install(runner)
 
         # delete profile
         runner.rm("profile/")
 
         # create new profile
-        profile = FirefoxProfile(profile="profile/", preferences=prefs)
+        if profiles.supported(self.engineInfo["platform"]):
+            def create(path):
+                FirefoxProfile(profile=path, preferences=prefs, restore=False)
+                profiles.warm(runner, binary, ["--no-remote", "--profile", path, "about:blank"], env)
+                # The warm-up gets killed, don't offer to restore its session.
+                profiles.remove(path, ["sessionstore.jsonlz4", "sessionstore-backups"])
+
+            profiles.clone(profiles.template(self.engineInfo, prefs, create), "profile")
+        else:
+            profile = FirefoxProfile(profile="profile/", preferences=prefs)
 
         self.reset_results()
 
@@ -143,7 +223,7 @@ class FirefoxExecutor(BrowserExecutor):
         process = runner.start(binary, args + ["--no-remote", "--profile", runner.getdir("profile")], env)
 
         # wait for results
-        self.wait_for_results(benchmark.timeout)
+        self.wait_for_results(benchmark.timeout, process)
 
         # kill browser
         print "Killing Firefox (after)..."
@@ -167,7 +247,7 @@ class ChromeExecutor(BrowserExecutor):
         runner.killAllInstances()
 
         # if needed install the executable
-        binary = runner.install(self.engineInfo["binary"])
+        binary = self.install(runner)
 
         # Chromium Helper needs to be executable too
         helpers = runner.find(self.engineInfo["folder"], "Chromium Helper")
@@ -179,11 +259,19 @@ class ChromeExecutor(BrowserExecutor):
 
         self.reset_results()
 
-        # enforce an empty user data directory to clear caches and previous
+        # enforce a fresh user data directory to clear caches and previous
         # settings
         runner.rm("profile/")
-        runner.mkdir("profile/")
-        runner.write("profile/First Run", "")
+        if profiles.supported(self.engineInfo["platform"]):
+            def create(path):
+                runner.write(os.path.join(path, "First Run"), "")
+                profiles.warm(runner, binary, ["--disable-setuid-sandbox",
+                                               "--user-data-dir=" + path, "about:blank"], env)
+
+            profiles.clone(profiles.template(self.engineInfo, prefs, create), "profile")
+        else:
+            runner.mkdir("profile/")
+            runner.write("profile/First Run", "")
 
         effective_args = ["--disable-setuid-sandbox"] + \
                          ["--user-data-dir=profile"] + \
@@ -193,7 +281,7 @@ class ChromeExecutor(BrowserExecutor):
         process = runner.start(binary, effective_args, env)
 
         # wait for results
-        self.wait_for_results(benchmark.timeout)
+        self.wait_for_results(benchmark.timeout, process)
 
         # kill browser
         print "Killing Chrome (after)..."
@@ -217,14 +305,15 @@ class WebKitExecutor(BrowserExecutor):
         runner.rm(os.path.join(os.environ.get("HOME"), "Library","Saved Application State","com.apple.Safari.savedState"))
 
         # if needed install the executable
-        binary = runner.install(self.engineInfo["binary"])
+        binary = self.install(runner)
 
         self.reset_results()
 
         # start browser
         process = runner.start("open", ["-F", "-a", binary] + args, env)
 
-        # wait for results
+        # wait for results ('open' returns immediately, so there is no
+        # browser process to watch)
         self.wait_for_results(benchmark.timeout)
 
         # kill browser
@@ -246,15 +335,21 @@ class ServoExecutor(BrowserExecutor):
         process = runner.start(self.engineInfo["binary"], args, env)
 
         # wait for results
-        self.wait_for_results(benchmark.timeout)
+        self.wait_for_results(benchmark.timeout, process)
 
         # kill browser
         print "Killing Servo (after)..."
         runner.kill(process)
 
 def make_executor(engineInfo):
+    if staging.enabled(engineInfo["platform"]):
+        engineInfo = staging.stage_engine(engineInfo)
+
     if engineInfo["shell"]:
-        return ShellExecutor(engineInfo)
+        executor = ShellExecutor(engineInfo)
+        if int(utils.config.getDefault('main', 'maxRuns', 1)) > 1:
+            return repetition.RepeatingExecutor(executor)
+        return executor
     if engineInfo["engine_type"] == "firefox":
         return FirefoxExecutor(engineInfo)
     if engineInfo["engine_type"] == "chrome":
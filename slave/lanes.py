@@ -0,0 +1,115 @@
+"""
+Runs independent shell benchmark jobs concurrently in lanes.
+
+Every lane is a worker process pinned to its own set of physical cores,
+with all their hardware threads. The JS shells it starts inherit that
+affinity, so lanes don't compete for cores or share them as SMT siblings. Only
+shell benchmarks on linux run in lanes, browsers and devices keep running
+one at a time.
+"""
+
+import multiprocessing
+import os
+import re
+import subprocess
+
+import benchmarks_shell
+
+# Id of the lane the current worker process runs, None outside of lanes.
+lane_id = None
+
+def supported(benchmark, info):
+    return isinstance(benchmark, benchmarks_shell.Benchmark) and \
+           info["shell"] and info["platform"] == "linux"
+
+CpuFolder = "/sys/devices/system/cpu"
+
+def read_topology(cpu, name):
+    with open(os.path.join(CpuFolder, "cpu" + str(cpu), "topology", name)) as fp:
+        return int(fp.read())
+
+def physical_cores():
+    """
+    Returns the cpus of every physical core, ordered by package and core.
+    Without topology information every cpu counts as a core.
+    """
+    cores = {}
+    names = os.listdir(CpuFolder) if os.path.isdir(CpuFolder) else []
+    for name in names:
+        m = re.match("cpu(\d+)$", name)
+        if not m:
+            continue
+        cpu = int(m.group(1))
+        try:
+            core = (read_topology(cpu, "physical_package_id"), read_topology(cpu, "core_id"))
+        except (IOError, ValueError):
+            # Offline cpus have no topology.
+            continue
+        cores.setdefault(core, []).append(cpu)
+
+    if not cores:
+        return [[cpu] for cpu in range(multiprocessing.cpu_count())]
+    return [sorted(cores[core]) for core in sorted(cores)]
+
+def cpu_sets(lanes, cores=None):
+    """
+    Splits the physical cores of the machine evenly over the lanes. Every
+    lane gets all hardware threads of its cores.
+    """
+    if cores is None:
+        cores = physical_cores()
+    per_lane = len(cores) // lanes
+    if per_lane == 0:
+        raise Exception("Can't run {} lanes on {} cores".format(lanes, len(cores)))
+    return [sorted(sum(cores[lane * per_lane:(lane + 1) * per_lane], [])) for lane in range(lanes)]
+
+def pin(pid, cpus):
+    # Python 2 has no os.sched_setaffinity, taskset does the same syscall.
+    with open(os.devnull, "w") as devnull:
+        subprocess.check_call(["taskset", "-pc", ",".join(str(cpu) for cpu in cpus), str(pid)],
+                              stdout=devnull)
+
+def alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+    return True
+
+def init_lane(owners, sets):
+    """
+    Claims a lane whose worker isn't running. The pool replaces workers that
+    died, their replacement takes over the lane of the dead worker.
+    """
+    global lane_id
+
+    with owners.get_lock():
+        for lane, owner in enumerate(owners):
+            if owner == 0 or not alive(owner):
+                owners[lane] = os.getpid()
+                lane_id = lane
+                break
+    if lane_id is None:
+        print "No free lane, running on all cpus"
+        return
+
+    cpus = sets[lane_id]
+    pin(os.getpid(), cpus)
+    print "Lane {} runs on cpus {}".format(lane_id, ",".join(str(cpu) for cpu in cpus))
+
+def run(function, jobs, lanes):
+    """
+    Runs function(job) for every job in lanes worker processes and yields
+    the results in the order they finish. The function runs in a forked
+    process, so it has to be a module level function.
+    """
+    # The pid of the worker that runs every lane.
+    owners = multiprocessing.Array("i", lanes)
+
+    pool = multiprocessing.Pool(lanes, init_lane, (owners, cpu_sets(lanes)))
+    try:
+        for result in pool.imap_unordered(function, jobs):
+            yield result
+    finally:
+        pool.close()
+        pool.join()
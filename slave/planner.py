@@ -0,0 +1,142 @@
+"""
+Plans the order in which execute.py runs the engine x config x benchmark
+matrix.
+
+All jobs are known up front. Jobs that run one after another are grouped per
+engine and per config, so every browser gets installed once and jobs with
+the same prefs follow each other. Within a group the longest jobs go first.
+Shell jobs that run in lanes are ordered longest first as well, which keeps
+lanes from idling at the end.
+
+Durations are estimated from earlier runs, kept in durations.json.
+"""
+
+import json
+import os
+
+import benchmarks
+import configs
+import lanes
+
+DurationsFile = "durations.json"
+
+# Estimate for jobs that never ran before, in seconds.
+DefaultDuration = 5 * 60
+
+# Number of earlier durations the estimate is averaged over.
+DurationHistory = 5
+
+class Job(object):
+    def __init__(self, name, benchmark, engine_path, info, config_name, laned):
+        self.name = name
+        self.benchmark = benchmark
+        self.engine_path = engine_path
+        self.info = info
+        self.config_name = config_name
+        self.laned = laned
+
+    def key(self):
+        return ",".join([self.info["engine_type"], self.config_name, self.name])
+
+    def describe(self):
+        return "{} - {} - {}".format(self.engine_path, self.config_name, self.name)
+
+class Durations(object):
+    def __init__(self, path=DurationsFile):
+        self.path = path
+        self.durations = {}
+        if os.path.exists(path):
+            try:
+                with open(path, "r") as fp:
+                    self.durations = json.load(fp)
+            except ValueError:
+                pass
+
+    def estimate(self, job):
+        history = self.durations.get(job.key())
+        if not history:
+            return DefaultDuration
+        return sum(history) / len(history)
+
+    def record(self, job, seconds):
+        history = self.durations.setdefault(job.key(), [])
+        history.append(seconds)
+        del history[:-DurationHistory]
+
+    def save(self):
+        with open(self.path + ".tmp", "w") as fp:
+            json.dump(self.durations, fp, indent=2, sort_keys=True)
+        os.rename(self.path + ".tmp", self.path)
+
+class Plan(object):
+    def __init__(self, serial, laned, lane_count, durations):
+        self.serial = serial
+        self.laned = laned
+        self.lane_count = lane_count
+        self.durations = durations
+
+    def lane_schedule(self):
+        """
+        Predicts which lane runs every laned job. Lanes pick up the next job
+        as soon as they're free.
+        """
+        finish = [0] * self.lane_count
+        schedule = []
+        for job in self.laned:
+            lane = finish.index(min(finish))
+            finish[lane] += self.durations.estimate(job)
+            schedule.append((lane, job))
+        return schedule, max(finish) if finish else 0
+
+    def drop(self, engine_path):
+        """
+        Removes all jobs of an engine, e.g. when its build couldn't be
+        submitted.
+        """
+        self.serial = [job for job in self.serial if job.engine_path != engine_path]
+        self.laned = [job for job in self.laned if job.engine_path != engine_path]
+
+    def predicted_time(self):
+        serial = sum(self.durations.estimate(job) for job in self.serial)
+        return serial + self.lane_schedule()[1]
+
+    def describe(self):
+        lines = []
+        for job in self.serial:
+            lines.append("{:>8.0f}s  {}".format(self.durations.estimate(job), job.describe()))
+        schedule, _ = self.lane_schedule()
+        for lane, job in schedule:
+            lines.append("{:>8.0f}s  {} (lane {})".format(self.durations.estimate(job),
+                                                        job.describe(), lane))
+        lines.append("Predicted wall time: {:.0f}s for {} jobs".format(
+            self.predicted_time(), len(self.serial) + len(self.laned)))
+        return "\n".join(lines)
+
+def plan(names, engines, config_names, lane_count, durations):
+    """
+    engines is a list of (engine_path, info) pairs.
+    """
+    serial = []
+    laned = []
+    for name in names:
+        benchmark = benchmarks.get(name)
+        for engine_path, info in engines:
+            for config_name in config_names:
+                config = configs.getConfig(config_name, info)
+                if config.omit():
+                    continue
+
+                use_lane = lane_count > 1 and lanes.supported(benchmark, info)
+                job = Job(name, benchmark, engine_path, info, config_name, use_lane)
+                if use_lane:
+                    laned.append(job)
+                else:
+                    serial.append(job)
+
+    engine_order = [engine_path for engine_path, info in engines]
+    serial.sort(key=lambda job: (engine_order.index(job.engine_path),
+                                 config_names.index(job.config_name),
+                                 -durations.estimate(job)))
+    laned.sort(key=lambda job: -durations.estimate(job))
+
+    return Plan(serial, laned, lane_count, durations)
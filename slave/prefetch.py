@@ -0,0 +1,186 @@
+#!/usr/bin/env python2
+
+"""
+Downloads builds in the background while benchmarks run.
+
+    python prefetch.py <download.py options>
+
+starts download.py detached, at the lowest cpu (nice) and I/O (ionice idle
+class) priority. The build ends up in the artifact store (see artifacts.py),
+so the next download.py with the same options hardlinks it into its output
+folder instead of downloading it. When that prefetch is still running,
+download.py waits for it instead of downloading the build a second time.
+
+execute.py --prefetch starts prefetches of the builds the next run needs.
+
+When the 'prefetchPause' option is set, execute.py creates a pause file
+while a benchmark runs. Prefetches check it between chunks of the download
+and before they touch the artifact store, and wait until it is gone, so they
+never add noise to the timings. They are never stopped in the middle of
+holding the artifact store lock.
+"""
+
+import contextlib
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+
+from distutils.spawn import find_executable
+
+import utils
+
+PrefetchFolder = "prefetch"
+PauseFile = os.path.join(PrefetchFolder, "paused")
+
+# Set in the environment of the download.py a prefetch runs.
+PrefetchEnv = "AWFY_PREFETCH"
+
+# Seconds between two looks at the pause file.
+PauseCheckInterval = 1
+
+last_check = 0
+
+# Short flags of download.py and their long form, so both spellings of an
+# option identify the same build.
+LongFlags = { "-o": "--output",
+              "-u": "--url",
+              "-c": "--config",
+              "-b": "--buildtype"
+            }
+
+def build_id(args):
+    """
+    Identifies a download by its download.py options, without the output
+    folder. The order of the options doesn't matter.
+    """
+    options = []
+    args = list(args)
+    while args:
+        arg = args.pop(0)
+        if "=" in arg and arg.startswith("--"):
+            flag, value = arg.split("=", 1)
+        elif args and not args[0].startswith("-"):
+            flag, value = arg, args.pop(0)
+        else:
+            flag, value = arg, None
+        flag = LongFlags.get(flag, flag)
+        if flag != "--output":
+            options.append((flag, value))
+    options.sort()
+    return hashlib.sha1(json.dumps(options)).hexdigest()[:16]
+
+def pid_file(id):
+    return os.path.join(PrefetchFolder, id + ".pid")
+
+def alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+    return True
+
+def pid_of(id):
+    try:
+        with open(pid_file(id), "r") as fp:
+            pid = int(fp.read())
+    except (IOError, ValueError):
+        return None
+    return pid if alive(pid) else None
+
+def low_priority():
+    command = ["nice", "-n", "19"]
+    if find_executable("ionice"):
+        command += ["ionice", "-c", "3"]
+    return command
+
+def start(args):
+    id = build_id(args)
+    if pid_of(id):
+        print "Already prefetching", " ".join(args)
+        return
+
+    if not os.path.isdir(PrefetchFolder):
+        os.makedirs(PrefetchFolder)
+
+    log = open(os.path.join(PrefetchFolder, id + ".log"), "w")
+    # A new session, so it keeps running when execute.py gets interrupted.
+    process = subprocess.Popen(low_priority() + [sys.executable, "prefetch.py", "--run", id] + args,
+                               stdout=log, stderr=subprocess.STDOUT, preexec_fn=os.setsid)
+    with open(pid_file(id), "w") as fp:
+        fp.write(str(process.pid))
+    print "Prefetching", " ".join(args), "in the background, pid", process.pid
+
+def run(id, args):
+    output = os.path.join(PrefetchFolder, id)
+    env = dict(os.environ)
+    env[PrefetchEnv] = "1"
+    try:
+        subprocess.call([sys.executable, "download.py"] + args + ["-o", output], env=env)
+    finally:
+        # The build is in the artifact store now.
+        if os.path.isdir(output):
+            shutil.rmtree(output)
+        os.unlink(pid_file(id))
+
+def wait(args):
+    """
+    Waits for a running prefetch of the same build to finish.
+    """
+    pid = pid_of(build_id(args))
+    if not pid or pid == os.getppid():
+        return
+
+    print "Waiting for the prefetch of this build (pid {}) to finish".format(pid)
+    while alive(pid):
+        time.sleep(1)
+
+def is_paused():
+    try:
+        with open(PauseFile, "r") as fp:
+            pid = int(fp.read())
+    except (IOError, ValueError):
+        return False
+    # The pause of an execute.py that died doesn't count.
+    return alive(pid)
+
+def pause_point():
+    """
+    Waits while a benchmark runs, when called from a prefetch. Downloads call
+    this between chunks and outside of the artifact store lock.
+    """
+    global last_check
+
+    if not os.environ.get(PrefetchEnv):
+        return
+    if time.time() - last_check < PauseCheckInterval:
+        return
+    while is_paused():
+        time.sleep(PauseCheckInterval)
+    last_check = time.time()
+
+@contextlib.contextmanager
+def paused():
+    """
+    Pauses all prefetches for the duration of a benchmark, if configured.
+    """
+    pause = utils.config.getDefault('main', 'prefetchPause', 'no') == 'yes'
+    if pause:
+        if not os.path.isdir(PrefetchFolder):
+            os.makedirs(PrefetchFolder)
+        with open(PauseFile, "w") as fp:
+            fp.write(str(os.getpid()))
+    try:
+        yield
+    finally:
+        if pause and os.path.exists(PauseFile):
+            os.unlink(PauseFile)
+
+if __name__ == "__main__":
+    if len(sys.argv) > 2 and sys.argv[1] == "--run":
+        run(sys.argv[2], sys.argv[3:])
+    else:
+        start(sys.argv[1:])
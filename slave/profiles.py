@@ -0,0 +1,106 @@
+"""
+Template browser profiles.
+
+Creating a profile and letting the browser initialize it on first start
+takes seconds and adds noise to short benchmarks. Instead, a template is
+built and warmed once per engine revision and config prefs. Every run gets
+a copy of it. Copies are made with reflinks where the filesystem supports
+them. Hardlinks can't be used, since browsers update their databases in
+place, which would change the template too.
+
+Templates live in profile-templates/ (option 'profileTemplates'). Only the
+most recently used ones are kept.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import time
+
+import utils
+
+# Number of templates kept around.
+MaxTemplates = 8
+
+# Files that tie a profile to a running browser. They are left out of copies.
+LockFiles = ["lock", ".parentlock", "parent.lock",
+             "SingletonLock", "SingletonCookie", "SingletonSocket"]
+
+def folder():
+    return utils.config.getDefault('main', 'profileTemplates', 'profile-templates')
+
+def warmup_time():
+    return int(utils.config.getDefault('main', 'profileWarmup', 10))
+
+def supported(platform):
+    # On android the profile lives on the device.
+    return platform != "android"
+
+def template_key(engineInfo, prefs):
+    key = json.dumps([engineInfo["engine_type"], engineInfo["revision"],
+                      engineInfo["binary"], prefs], sort_keys=True)
+    return hashlib.sha1(key).hexdigest()
+
+def remove(path, names):
+    """
+    Removes the files and directories with these names anywhere in path.
+    """
+    for root, dirs, files in os.walk(path):
+        for name in files + dirs:
+            if name in names:
+                full = os.path.join(root, name)
+                if os.path.isdir(full) and not os.path.islink(full):
+                    shutil.rmtree(full)
+                else:
+                    os.unlink(full)
+
+def prune(keep):
+    templates = [os.path.join(folder(), name) for name in os.listdir(folder())]
+    templates = [path for path in templates if os.path.isdir(path) and path != keep]
+    templates.sort(key=os.path.getmtime, reverse=True)
+    for path in templates[MaxTemplates - 1:]:
+        print "Removing profile template", path
+        shutil.rmtree(path)
+
+def template(engineInfo, prefs, create):
+    """
+    Returns the path of the template for this engine and prefs. Calls
+    create(path) to build and warm it when it doesn't exist yet.
+    """
+    path = os.path.join(folder(), template_key(engineInfo, prefs))
+    if not os.path.isdir(path):
+        print "Creating profile template", path
+        tmp = path + ".tmp"
+        if os.path.exists(tmp):
+            shutil.rmtree(tmp)
+        os.makedirs(tmp)
+        create(os.path.abspath(tmp))
+        remove(tmp, LockFiles)
+        os.rename(tmp, path)
+
+    os.utime(path, None)
+    prune(path)
+    return path
+
+def warm(runner, binary, args, env):
+    """
+    Starts the browser on a template once, so it initializes the profile.
+    """
+    process = runner.start(binary, args, env)
+    time.sleep(warmup_time())
+    runner.kill(process)
+    runner.killAllInstances()
+
+def clone(template, target):
+    if os.path.exists(target):
+        shutil.rmtree(target)
+
+    if os.name == "posix" and subprocess.call(["cp", "-a", "--reflink=auto", template, target]) == 0:
+        remove(target, LockFiles)
+        return
+
+    if os.path.exists(target):
+        shutil.rmtree(target)
+    shutil.copytree(template, target, symlinks=True, ignore=shutil.ignore_patterns(*LockFiles))
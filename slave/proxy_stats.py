@@ -0,0 +1,66 @@
+"""
+Per request measurements of the benchmark proxy (server.py), so a slow
+browser benchmark can be attributed to either the engine or the proxy.
+
+Every request records:
+- host, path, status
+- cache: "hit" or "miss" for remote benchmarks, "local" for local files
+- fetch: seconds spent retrieving the response upstream
+- inject: seconds spent injecting code into the body
+- bytes: size of the body sent
+- latency: seconds from reading the request until the response was written
+"""
+
+import threading
+
+class RequestLog(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = []
+
+    def add(self, request):
+        with self.lock:
+            self.requests.append(request)
+
+    def take(self):
+        """ Returns all recorded requests and starts a new log. """
+        with self.lock:
+            requests = self.requests
+            self.requests = []
+        return requests
+
+def percentile(values, p):
+    if not values:
+        return 0
+    values = sorted(values)
+    index = int(round(p / 100.0 * (len(values) - 1)))
+    return values[index]
+
+def summarize(requests):
+    latencies = [request["latency"] for request in requests]
+    hits = len([request for request in requests if request["cache"] == "hit"])
+    misses = len([request for request in requests if request["cache"] == "miss"])
+
+    return {
+        "requests": len(requests),
+        "hits": hits,
+        "misses": misses,
+        "hit_rate": float(hits) / (hits + misses) if hits + misses else None,
+        "bytes": sum(request["bytes"] for request in requests),
+        "latency_p50": percentile(latencies, 50),
+        "latency_p95": percentile(latencies, 95),
+        "latency_max": max(latencies) if latencies else 0,
+        "fetch_time": sum(request["fetch"] for request in requests),
+        "inject_time": sum(request["inject"] for request in requests),
+    }
+
+def format_summary(summary):
+    hit_rate = "n/a"
+    if summary["hit_rate"] is not None:
+        hit_rate = "{:.0f}%".format(summary["hit_rate"] * 100)
+    return "{} requests, hit rate {}, latency p50 {:.0f}ms p95 {:.0f}ms max {:.0f}ms, " \
+           "{:.1f}MB, fetch {:.1f}s, inject {:.1f}s".format(
+               summary["requests"], hit_rate,
+               summary["latency_p50"] * 1000, summary["latency_p95"] * 1000,
+               summary["latency_max"] * 1000, summary["bytes"] / 1e6,
+               summary["fetch_time"], summary["inject_time"])
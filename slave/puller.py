@@ -1,3 +1,6 @@
+import contextlib
+import fcntl
+import hashlib
 import re
 import os
 import shutil
@@ -179,7 +182,140 @@ class MozillaTry(HG):
             raise Exception('unknown output from hg: ' + output)
         return m.group(1)
 
-def getPuller(repo, path):
+def mirror_path(mirrors, repo):
+    name = re.sub("[^A-Za-z0-9]+", "-", repo).strip("-")
+    return os.path.join(mirrors, name[-40:] + "-" + hashlib.sha1(repo).hexdigest()[:8])
+
+@contextlib.contextmanager
+def locked(path):
+    """
+    Serializes fetches into a mirror between concurrent builds.
+    """
+    with open(path + ".lock", "w") as fp:
+        fcntl.flock(fp, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(fp, fcntl.LOCK_UN)
+
+class Worktree(object):
+    """
+    A checkout backed by a mirror of the repository shared with all other
+    checkouts of it. The mirror is cloned once and only fetched when a
+    revision is asked for that it doesn't have yet. Every output folder gets
+    its own checkout, so several revisions can be built at the same time.
+    """
+    def __init__(self, repo, folder, mirrors):
+        self.repo = repo
+        self.folder = folder
+        self.mirror = os.path.abspath(mirror_path(mirrors, repo))
+
+        if not os.path.isdir(mirrors):
+            os.makedirs(mirrors)
+        with locked(self.mirror):
+            if not os.path.exists(self.mirror):
+                self.clone_mirror()
+
+    def path(self):
+        return self.folder
+
+    def update(self, rev = None):
+        with locked(self.mirror):
+            if not rev or not self.has(rev):
+                self.fetch(rev)
+            if not self.sameRepo():
+                try:
+                    shutil.rmtree(self.folder)
+                except:
+                    pass
+                self.share()
+        self.checkout(rev)
+
+class GITWorktree(Worktree, GIT):
+    def git(self, *args):
+        return Run(['git', '--git-dir', self.mirror] + list(args))
+
+    def clone_mirror(self):
+        Run(['git', 'clone', '--mirror', self.repo, self.mirror])
+
+    def has(self, rev):
+        try:
+            self.git('cat-file', '-e', rev + '^{commit}')
+        except:
+            return False
+        return True
+
+    def fetch(self, rev):
+        self.git('fetch', '--prune', 'origin')
+
+    def sameRepo(self):
+        if not os.path.isfile(os.path.join(self.folder, ".git")):
+            return False
+        with open(os.path.join(self.folder, ".git")) as fp:
+            return os.path.join(self.mirror, "worktrees") in fp.read()
+
+    def share(self):
+        # Forget about worktrees whose folder was removed.
+        self.git('worktree', 'prune')
+        self.git('worktree', 'add', '--detach', os.path.abspath(self.folder), 'HEAD')
+
+    def checkout(self, rev):
+        with chdir(self.path()):
+            # HEAD of the mirror is the tip of the default branch.
+            Run(['git', 'checkout', '--force', '--detach', rev or self.head()])
+
+    def head(self):
+        return self.git('rev-parse', 'HEAD').strip()
+
+class HGShare(Worktree, HG):
+    # Where revisions are pulled from, when not from the repo itself.
+    source = None
+
+    def hg(self, *args):
+        return Run(['hg', '-R', self.mirror] + list(args))
+
+    def clone_mirror(self):
+        Run(['hg', 'clone', '--noupdate', self.repo, self.mirror])
+
+    def has(self, rev):
+        try:
+            self.hg('log', '-r', rev, '--template', '{node}')
+        except:
+            return False
+        return True
+
+    def fetch(self, rev):
+        if self.source:
+            self.hg('pull', '-r', rev, self.source)
+        else:
+            self.hg('pull')
+
+    def sameRepo(self):
+        sharedpath = os.path.join(self.folder, ".hg", "sharedpath")
+        if not os.path.isfile(sharedpath):
+            return False
+        with open(sharedpath) as fp:
+            return fp.read().strip() == os.path.join(self.mirror, ".hg")
+
+    def share(self):
+        Run(['hg', '--config', 'extensions.share=', 'share', '--noupdate', self.mirror, self.folder])
+
+    def checkout(self, rev):
+        output = Run(['hg', 'update', '--clean', '-r', rev or 'default', '--cwd', self.folder])
+        if re.search("unknown revision", output) != None:
+            raise Exception('unknown revision: ' + output)
+
+class MozillaTryShare(HGShare):
+    source = "https://hg.mozilla.org/try"
+
+    def __init__(self, folder, mirrors):
+        super(MozillaTryShare, self).__init__("https://hg.mozilla.org/mozilla-unified", folder, mirrors)
+
+    def update(self, rev = None):
+        assert rev != None
+        super(MozillaTryShare, self).update(rev)
+
+def getPuller(repo, path, mirrors=None):
     if repo == "mozilla":
         repo = "http://hg.mozilla.org/integration/mozilla-inbound"
     elif repo == "webkit":
@@ -187,6 +323,15 @@ def getPuller(repo, path):
     elif repo == "servo":
         repo = "https://github.com/servo/servo.git"
 
+    if mirrors:
+        if "mozilla-try" == repo:
+            return MozillaTryShare(path, mirrors)
+        if "hg." in repo:
+            return HGShare(repo, path, mirrors)
+        if repo.endswith(".git"):
+            return GITWorktree(repo, path, mirrors)
+        raise Exception("No mirror support for " + repo)
+
     if "mozilla-try" == repo:
         return MozillaTry(path)
     if "hg." in repo:
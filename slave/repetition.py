@@ -0,0 +1,94 @@
+"""
+Repeats a benchmark until its scores are stable enough.
+
+A benchmark is run at least minRuns times. After that it is repeated until
+the 95% confidence interval of every test is within repeatConfidence of its
+mean (e.g. 0.01 for +-1%), until maxRuns runs or until another run would
+exceed the time budget. The reported time of every test is the mean of its
+samples, together with the stddev and the number of samples.
+"""
+
+import math
+import time
+
+import utils
+
+# Two sided 95% quantiles of Student's t-distribution, by degrees of freedom.
+TQuantiles = { 1: 12.706, 2: 4.303, 3: 3.182, 4: 2.776, 5: 2.571, 6: 2.447,
+               7: 2.365, 8: 2.306, 9: 2.262, 10: 2.228, 15: 2.131, 20: 2.086,
+               30: 2.042 }
+
+def t_quantile(df):
+    for known in sorted(TQuantiles):
+        if df <= known:
+            return TQuantiles[known]
+    return 1.96
+
+def mean(samples):
+    return sum(samples) / len(samples)
+
+def stddev(samples):
+    if len(samples) < 2:
+        return 0.0
+    m = mean(samples)
+    return math.sqrt(sum((sample - m) ** 2 for sample in samples) / (len(samples) - 1))
+
+def relative_interval(samples):
+    """
+    Half the width of the 95% confidence interval of the mean, relative to
+    the mean.
+    """
+    if len(samples) < 2:
+        return float("inf")
+    m = mean(samples)
+    if m == 0:
+        return 0.0
+    return t_quantile(len(samples) - 1) * stddev(samples) / math.sqrt(len(samples)) / abs(m)
+
+class RepeatingExecutor(object):
+    def __init__(self, executor):
+        self.executor = executor
+        self.min_runs = int(utils.config.getDefault('main', 'minRuns', 3))
+        self.max_runs = int(utils.config.getDefault('main', 'maxRuns', 1))
+        self.confidence = float(utils.config.getDefault('main', 'repeatConfidence', 0.01))
+        self.budget = int(utils.config.getDefault('main', 'repeatBudget', 30 * 60))
+
+    def stable(self, samples):
+        return all(relative_interval(values) <= self.confidence for values in samples.values())
+
+    def run(self, benchmark, config):
+        names = []
+        samples = {}
+        start = time.time()
+        runs = 0
+
+        while True:
+            results = self.executor.run(benchmark, config)
+            if not results:
+                break
+
+            runs += 1
+            for test in results:
+                if test['name'] not in samples:
+                    names.append(test['name'])
+                    samples[test['name']] = []
+                samples[test['name']].append(float(test['time']))
+
+            if runs >= self.max_runs:
+                break
+
+            elapsed = time.time() - start
+            if runs >= self.min_runs and self.stable(samples):
+                print "Stable after {} runs".format(runs)
+                break
+            if elapsed + elapsed / runs > self.budget:
+                print "Stopping after {} runs, out of time budget".format(runs)
+                break
+
+        if not runs:
+            return None
+
+        return [{ 'name': name,
+                  'time': mean(samples[name]),
+                  'stddev': stddev(samples[name]),
+                  'samples': len(samples[name]) } for name in names]
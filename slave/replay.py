@@ -0,0 +1,197 @@
+"""
+Record/replay store for the responses of remote benchmarks.
+
+Every benchmark version gets one archive in cache/:
+- <host>-<version>.data:  the pickled [status, headers, data] responses,
+                          appended one after another.
+- <host>-<version>.index: one JSON line per response with its key, offset
+                          and length in the data file.
+
+Recording a response that is already stored byte for byte doesn't touch the
+archive. A changed response is appended and replaces the old one in the
+index. Once more than half of the data file is replaced responses, the
+archive gets compacted.
+
+Responses are keyed on the method, host, path (including the query) and a
+hash of the request body. Hot entries are kept in an in-memory LRU.
+"""
+
+import collections
+import hashlib
+import json
+import os
+import pickle
+import threading
+
+Modes = ["cache", "record", "replay"]
+
+class ReplayMiss(Exception):
+    pass
+
+def request_key(method, host, path, body):
+    body_hash = hashlib.sha1(body or "").hexdigest()
+    return hashlib.sha1(method + " " + host + path + " " + body_hash).hexdigest()
+
+class LRU(object):
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.entries:
+                return None
+            value, size = self.entries.pop(key)
+            self.entries[key] = (value, size)
+            return value
+
+    def put(self, key, value, size):
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.size -= self.entries.pop(key)[1]
+            self.entries[key] = (value, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                old_key, (old_value, old_size) = self.entries.popitem(last=False)
+                self.size -= old_size
+
+class Archive(object):
+    def __init__(self, name, lru):
+        self.name = name
+        self.data_path = os.path.join("cache", name + ".data")
+        self.index_path = os.path.join("cache", name + ".index")
+        self.lru = lru
+        self.lock = threading.Lock()
+
+        self.index = {}
+        # Bytes of the data file taken by responses that got replaced.
+        self.garbage = 0
+        if os.path.exists(self.index_path):
+            with open(self.index_path, "r") as fp:
+                for line in fp:
+                    try:
+                        key, offset, length = json.loads(line)
+                    except ValueError:
+                        # Partially written last line.
+                        continue
+                    self.index[key] = (offset, length)
+        if os.path.exists(self.data_path):
+            self.garbage = os.path.getsize(self.data_path) - \
+                           sum(length for offset, length in self.index.values())
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def get(self, key):
+        response = self.lru.get((self.name, key))
+        if response is not None:
+            return response
+
+        if key not in self.index:
+            return None
+        with self.lock:
+            record = self.read(key)
+        response = pickle.loads(record)
+        self.lru.put((self.name, key), response, len(record))
+        return response
+
+    def read(self, key):
+        offset, length = self.index[key]
+        with open(self.data_path, "rb") as fp:
+            fp.seek(offset)
+            return fp.read(length)
+
+    def put(self, key, response):
+        record = pickle.dumps(response, pickle.HIGHEST_PROTOCOL)
+        with self.lock:
+            if key in self.index and self.read(key) == record:
+                return
+            if not os.path.exists("cache"):
+                os.mkdir("cache")
+            with open(self.data_path, "ab") as fp:
+                fp.seek(0, os.SEEK_END)
+                offset = fp.tell()
+                fp.write(record)
+            # Only index a response once it is completely written.
+            with open(self.index_path, "a") as fp:
+                fp.write(json.dumps([key, offset, len(record)]) + "\n")
+            if key in self.index:
+                self.garbage += self.index[key][1]
+            self.index[key] = (offset, len(record))
+
+            if self.garbage * 2 > offset + len(record):
+                self.compact()
+        self.lru.put((self.name, key), response, len(record))
+
+    def compact(self):
+        """ Rewrites the data and index file with only the current response
+        of every key. """
+        index = {}
+        with open(self.data_path, "rb") as old, \
+             open(self.data_path + ".tmp", "wb") as data, \
+             open(self.index_path + ".tmp", "w") as lines:
+            for key, (offset, length) in sorted(self.index.items(), key=lambda item: item[1][0]):
+                old.seek(offset)
+                index[key] = (data.tell(), length)
+                data.write(old.read(length))
+                lines.write(json.dumps([key, index[key][0], length]) + "\n")
+
+        # Without the index in between, a crash loses the archive instead of
+        # pairing the new data file with the old offsets.
+        os.unlink(self.index_path)
+        os.rename(self.data_path + ".tmp", self.data_path)
+        os.rename(self.index_path + ".tmp", self.index_path)
+        self.index = index
+        self.garbage = 0
+
+class Store(object):
+    def __init__(self, mode="cache", lru_bytes=64 * 1024 * 1024):
+        if mode not in Modes:
+            raise Exception("Unknown proxy mode: " + mode)
+        self.mode = mode
+        self.lru = LRU(lru_bytes)
+        self.archives = {}
+        self.lock = threading.Lock()
+
+    def archive(self, name):
+        with self.lock:
+            if name not in self.archives:
+                self.archives[name] = Archive(name, self.lru)
+            return self.archives[name]
+
+    def legacy_response(self, name, host, path):
+        """ Responses cached before the archives existed were pickled in
+        cache/<host>-<version>/<sha1(host + path)>, for GET requests only. """
+        legacy_path = os.path.join("cache", name, hashlib.sha1(host + path).hexdigest())
+        if not os.path.exists(legacy_path):
+            return None
+        with open(legacy_path, "rb") as fp:
+            return pickle.load(fp)
+
+    def retrieve(self, name, method, host, path, body, fetch):
+        """ Returns [status, headers, data] for a request. fetch() retrieves
+        the response from the network. """
+        archive = self.archive(name)
+        key = request_key(method, host, path, body)
+
+        if self.mode != "record":
+            response = archive.get(key)
+            if response is not None:
+                return response
+
+            if method == "GET" and not body:
+                response = self.legacy_response(name, host, path)
+                if response is not None:
+                    archive.put(key, response)
+                    return response
+
+            if self.mode == "replay":
+                raise ReplayMiss(method + " " + host + path + " is not in archive " + name)
+
+        response = list(fetch())
+        archive.put(key, response)
+        return response
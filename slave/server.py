@@ -1,39 +1,91 @@
 import BaseHTTPServer
+import SocketServer
 import hashlib
 import httplib
 import json
+import mmap
 import os
-import pickle
 import requests
-import signal
 import sys
+import threading
+import time
 import urllib
 import urlparse
 
+from optparse import OptionParser
 from SimpleHTTPServer import SimpleHTTPRequestHandler
 
 import benchmarks_remote as benchmarks
 
+import proxy_stats
+import replay
 import utils
 utils.config.init("awfy.config")
 translates = utils.config.benchmarkTranslates()
 
 seen_cachedirs = {}
+cachedirs_lock = threading.Lock()
 prev_host = None
+request_log = proxy_stats.RequestLog()
+
+# Pages the heartbeat gets injected in, as Host header + path. Only the top
+# level page the executor opened (see /harness) and the pages it redirects
+# to. Benchmark documents and their frames are served unchanged.
+harness_pages = set()
+
+# Injected in the harness page, so the executor can tell a page that is
+# still running from a hung one.
+HeartbeatScript = ("<script>"
+                   "setInterval(function () {"
+                   "    new Image().src = 'http://localhost:8000/heartbeat?' + Date.now();"
+                   "}, 10000);"
+                   "</script>")
+
+# Bodies after injection are memoized in the store. Bump this when changing
+# what gets injected, to invalidate them.
+InjectionVersion = 2
+
+# Bodies are written to the socket in chunks of this size.
+ChunkSize = 256 * 1024
+
+def injection_key(*parts):
+    parts = [str(InjectionVersion)] + [str(part) for part in parts]
+    return hashlib.sha1("\0".join(parts)).hexdigest()
 
 class FakeHandler(SimpleHTTPRequestHandler):
-    def handle_one_request(self):
-        """ This sometimes times out. Don't block """
-        with utils.Handler(signal.SIGALRM, utils.timeout_handler):
-            try:
-                timeout = int(utils.config.getDefault('main', 'serverTimeout', 20))
+    # Per connection socket timeout. A connection that stays idle longer gets
+    # closed, instead of blocking a handler thread.
+    timeout = int(utils.config.getDefault('main', 'serverTimeout', 20))
 
-                signal.alarm(timeout)
-                SimpleHTTPRequestHandler.handle_one_request(self)
-            except utils.TimeException:
-                print "Server - timeout"
-            finally:
-                signal.alarm(0)
+    # Measurements of the request being handled, see proxy_stats.
+    stats = None
+
+    def begin_request(self):
+        if self.path.startswith("/heartbeat") or self.path.startswith("/proxy-stats") or \
+           self.path.startswith("/harness"):
+            self.stats = None
+            return
+        self.stats = { "host": self.headers.get("Host", ""),
+                       "path": self.path,
+                       "status": None,
+                       "cache": "local",
+                       "fetch": 0,
+                       "inject": 0,
+                       "bytes": 0,
+                       "start": time.time() }
+
+    def end_request(self):
+        if self.stats is None:
+            return
+        stats = self.stats
+        self.stats = None
+        stats["latency"] = time.time() - stats.pop("start")
+        request_log.add(stats)
+
+    def send_response(self, code, message=None):
+        if self.stats is not None:
+            self.stats["status"] = code
+        SimpleHTTPRequestHandler.send_response(self, code, message)
 
     def maybe_flush(self):
         global prev_host
@@ -44,6 +96,20 @@ class FakeHandler(SimpleHTTPRequestHandler):
             prev_host = new_host
 
     def do_GET(self):
+        self.begin_request()
+        try:
+            self.handle_get()
+        finally:
+            self.end_request()
+
+    def do_POST(self):
+        self.begin_request()
+        try:
+            self.handle_post()
+        finally:
+            self.end_request()
+
+    def handle_get(self):
         self.maybe_flush()
 
         if self.remote_benchmark():
@@ -55,7 +121,7 @@ class FakeHandler(SimpleHTTPRequestHandler):
 
         self.send_error(404, "File not found")
 
-    def do_POST(self):
+    def handle_post(self):
         self.maybe_flush()
 
         length = int(self.headers.getheader('content-length', 0))
@@ -72,6 +138,12 @@ class FakeHandler(SimpleHTTPRequestHandler):
     def local_benchmark(self, query = None):
         if self.path.startswith("/submit"):
             return self.capture_results(query)
+        if self.path.startswith("/heartbeat"):
+            return self.capture_heartbeat()
+        if self.path.startswith("/proxy-stats"):
+            return self.send_proxy_stats()
+        if self.path.startswith("/harness"):
+            return self.set_harness(query)
 
         return self.retrieve_offline()
 
@@ -79,8 +151,10 @@ class FakeHandler(SimpleHTTPRequestHandler):
         path = self.translate_path(self.path)
         if os.path.isdir(path) and not self.path.endswith('/'):
             # redirect browser - doing basically what apache does
+            self.follow_harness(self.path + "/")
             self.send_response(301)
             self.send_header("Location", self.path + "/")
+            self.send_header("Content-Length", 0)
             self.end_headers()
             return True
 
@@ -96,6 +170,9 @@ class FakeHandler(SimpleHTTPRequestHandler):
             else:
                 # list directory
                 f = self.list_directory(path)
+                if f:
+                    self.copyfile(f, self.wfile)
+                    f.close()
                 return True
 
         # load file
@@ -109,25 +186,44 @@ class FakeHandler(SimpleHTTPRequestHandler):
             self.send_error(404, "File not found")
             return True
 
-        content = f.read()
-        content = self.inject_data("localhost", self.path, content)
+        harness = self.is_harness()
+        def inject(content):
+            content = self.inject_data("localhost", self.path, content)
+            return self.inject_heartbeat(ctype, content) if harness else content
 
-        self.send_response(200)
-        self.send_header("Content-type", ctype)
-        self.send_header("Content-Length", len(content))
         fs = os.fstat(f.fileno())
-        self.send_header("Last-Modified", self.date_time_string(fs.st_mtime))
-        self.end_headers()
+        key = injection_key(self.path, ctype, fs.st_mtime, fs.st_size, harness)
+        headers = [("Content-type", ctype),
+                   ("Last-Modified", self.date_time_string(fs.st_mtime))]
+
+        # Files that are known to come out of injection unchanged are sent
+        # straight from a memory map, without reading them in.
+        cached = self.cached_injection("localhost", key)
+        if cached is not None and cached[0] is None and fs.st_size > 0:
+            content = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                self.send_content(200, headers, content, fs.st_size)
+            finally:
+                content.close()
+                f.close()
+            return True
 
-        self.wfile.write(bytes(content))
+        content = self.injected("localhost", key, f.read(), inject)
         f.close()
+
+        self.send_content(200, headers, content, len(content))
         return True
 
     def capture_results(self, query):
         parsed_query = urlparse.parse_qs(query)
-        fp = open("slave/results", "w")
+
+        # Write to a temporary file first, so the executor never sees a
+        # partially written results file.
+        fp = open("slave/results.tmp", "w")
         fp.write(parsed_query["results"][0])
         fp.close()
+        os.rename("slave/results.tmp", "slave/results")
+        utils.notify_results()
 
         content = "Results successfully captured!"
         self.send_response(200)
@@ -136,6 +232,45 @@ class FakeHandler(SimpleHTTPRequestHandler):
         self.wfile.write(bytes(content))
         return True
 
+    def capture_heartbeat(self):
+        utils.notify_heartbeat()
+
+        self.send_response(204)
+        self.send_header("Content-Length", 0)
+        self.end_headers()
+        return True
+
+    def set_harness(self, query):
+        """ Registers the url the executor opens as the harness page. """
+        url = urlparse.urlparse(urlparse.parse_qs(query)["url"][0])
+        path = url.path or "/"
+        if url.query:
+            path += "?" + url.query
+        harness_pages.clear()
+        harness_pages.add(url.netloc + path)
+
+        self.send_response(204)
+        self.send_header("Content-Length", 0)
+        self.end_headers()
+        return True
+
+    def is_harness(self):
+        return self.headers.get("Host", "") + self.path in harness_pages
+
+    def follow_harness(self, path):
+        """ A redirect of the harness page leads to the harness page. """
+        if self.is_harness():
+            harness_pages.add(self.headers.get("Host", "") + path)
+
+    def send_proxy_stats(self):
+        """ Returns the requests served since the last call, with a summary,
+        and starts a new log. """
+        requests = request_log.take()
+        content = json.dumps({ "summary": proxy_stats.summarize(requests),
+                               "requests": requests })
+        self.send_content(200, [("Content-type", "application/json")], content, len(content))
+        return True
+
     def translate_benchmark_path(self, old_host, old_path):
         global translates, benchmarks
         protocol = None
@@ -165,13 +300,33 @@ class FakeHandler(SimpleHTTPRequestHandler):
             return False
 
         if self.path != path:
+            self.follow_harness(path)
             self.send_response(301)
             self.send_header('Location', 'http://' + host + path)
+            self.send_header('Content-Length', 0)
             self.end_headers()
             return True
 
-        status, headers, data = self.retrieve(protocol, url, path, version, postdata)
-        data = self.inject_data(host, path, data)
+        try:
+            status, headers, data = self.retrieve(protocol, url, path, version, postdata)
+        except replay.ReplayMiss as e:
+            print "REPLAY MISS (server):", e
+            if self.stats is not None:
+                self.stats["cache"] = "miss"
+            self.send_error(502, str(e))
+            return True
+        ctype = ""
+        for name, header in headers:
+            if name.lower() == "content-type":
+                ctype = header
+
+        harness = self.is_harness()
+        def inject(data):
+            data = self.inject_data(host, path, data)
+            return self.inject_heartbeat(ctype, data) if harness else data
+
+        key = injection_key(host, path, ctype, hashlib.sha1(data).hexdigest(), harness)
+        data = self.injected(url + "-" + version, key, data, inject)
 
         if status == 301 or status == 302:
             for i in range(len(headers)):
@@ -182,54 +337,41 @@ class FakeHandler(SimpleHTTPRequestHandler):
                     else:
                         location = "/".join(location[3:])
                     headers[i] = ("Location", "http://" + host + location)
+                    self.follow_harness(location if location.startswith("/") else "/" + location)
 
-        self.send_response(status)
-
-        for name, header in headers:
-            name = name.lower()
-            if name in ["content-length", "accept-ranges", "connection", "transfer-encoding", "content-encoding"]:
-                continue
-            self.send_header(name, header)
-
-        self.send_header("content-length", len(data))
-        self.send_header("connection", "close")
-        self.end_headers()
-        self.wfile.write(bytes(data))
+        headers = [(name, header) for name, header in headers
+                   if name.lower() not in ["content-length", "accept-ranges", "connection",
+                                           "transfer-encoding", "content-encoding"]]
+        self.send_content(status, headers, data, len(data))
         return True
 
     def retrieve(self, protocol, host, path, version, postdata):
-        hex_dig = hashlib.sha1(host + path).hexdigest()
-
         bench_dir_name = host + "-" + version
-        cached_path = "cache/" + bench_dir_name + "/" + hex_dig
 
         # One-off migration: if there's a cache dir with the previous name
         # format, assume it's the latest version and rename it.
-        if seen_cachedirs.get(bench_dir_name, None) is None:
-            if os.path.exists("cache/" + host + "/"):
-                os.rename("cache/" + host, "cache/" + bench_dir_name)
-            seen_cachedirs[bench_dir_name] = True
-
-        if os.path.exists(cached_path):
-            # Reuse the cached version.
-            fp = open(cached_path, "rb")
-            status, headers, data = pickle.load(fp)
-            fp.close()
-            return status, headers, data
-
-        # Lookup the online version and cache it.
-        status, headers, data = self.retrieve_online(protocol, host, path, postdata)
-
-        if not os.path.exists("cache"):
-            os.mkdir("cache")
-        if not os.path.exists("cache/" + bench_dir_name):
-            os.mkdir("cache/" + bench_dir_name)
-
-        fp = open(cached_path, "wb")
-        pickle.dump([status, headers, data], fp)
-        fp.close()
+        with cachedirs_lock:
+            if seen_cachedirs.get(bench_dir_name, None) is None:
+                if os.path.exists("cache/" + host + "/"):
+                    os.rename("cache/" + host, "cache/" + bench_dir_name)
+                seen_cachedirs[bench_dir_name] = True
+
+        def fetch():
+            start = time.time()
+            try:
+                return self.retrieve_online(protocol, host, path, postdata)
+            finally:
+                if self.stats is not None:
+                    self.stats["cache"] = "miss"
+                    self.stats["fetch"] = time.time() - start
 
-        return status, headers, data
+        if self.stats is not None:
+            self.stats["cache"] = "hit"
+
+        status, headers, data = store.retrieve(bench_dir_name, self.command, host, path,
+                                               postdata, fetch)
+        # The headers get rewritten for redirects. Don't touch the cached copy.
+        return status, list(headers), data
 
     def retrieve_online(self, protocol, host, path, postdata):
         headers = {
@@ -242,16 +384,106 @@ class FakeHandler(SimpleHTTPRequestHandler):
         url = protocol + "://" + host + path
 
         if not postdata:
-            response = requests.get(url=url, headers=headers, verify=False)
+            response = requests.get(url=url, headers=headers, verify=False, timeout=self.timeout)
         else:
             headers["Content-Length"] = str(len(postdata))
-            response = requests.post(url=url, data=postdata, headers=headers, verify=False)
+            response = requests.post(url=url, data=postdata, headers=headers, verify=False,
+                                     timeout=self.timeout)
 
         headers = [[key, response.headers[key]] for key in response.headers]
         data = response.content
 
         return response.status_code, headers, data
 
+    def parse_range(self, size):
+        """ Returns (first, last) byte of a single range request, None to
+        send everything and False when the range can't be satisfied. """
+        header = self.headers.get("Range")
+        if not header or not header.startswith("bytes=") or "," in header:
+            return None
+
+        first, _, last = header[len("bytes="):].strip().partition("-")
+        try:
+            if first == "":
+                # Suffix range: the last bytes of the body.
+                length = int(last)
+                if length <= 0:
+                    return False
+                return max(0, size - length), size - 1
+            first = int(first)
+            last = int(last) if last else size - 1
+        except ValueError:
+            return None
+
+        if first >= size or last < first:
+            return False
+        return first, min(last, size - 1)
+
+    def send_content(self, status, headers, body, size):
+        """ Sends a response with body, which can be a string or a memory
+        map. Range requests on successful responses get a partial body. """
+        byte_range = self.parse_range(size) if status == 200 else None
+        if byte_range is False:
+            self.send_response(416)
+            self.send_header("Content-Range", "bytes */" + str(size))
+            self.send_header("Content-Length", 0)
+            self.end_headers()
+            return
+
+        first, last = 0, size - 1
+        if byte_range:
+            first, last = byte_range
+            status = 206
+
+        self.send_response(status)
+        for name, header in headers:
+            self.send_header(name, header)
+        if status in [200, 206]:
+            self.send_header("Accept-Ranges", "bytes")
+        if byte_range:
+            self.send_header("Content-Range", "bytes {}-{}/{}".format(first, last, size))
+        self.send_header("Content-Length", last - first + 1)
+        self.end_headers()
+        self.wfile.flush()
+        if self.stats is not None:
+            self.stats["bytes"] = last - first + 1
+
+        # Write buffers straight to the socket. Going through wfile would copy
+        # every chunk into a new string.
+        offset = first
+        while offset <= last:
+            length = min(ChunkSize, last - offset + 1)
+            self.connection.sendall(buffer(body, offset, length))
+            offset += length
+
+    def cached_injection(self, name, key):
+        """ Returns None when not memoized yet. Otherwise a list holding the
+        injected body, or None when injection doesn't change the body. """
+        return store.archive(name + "-injected").get(key)
+
+    def injected(self, name, key, data, inject):
+        """ Returns inject(data), memoized in the store under key. Bodies
+        that don't change are recorded as None instead of a second copy. """
+        cached = self.cached_injection(name, key)
+        if cached is None:
+            start = time.time()
+            injected = inject(data)
+            if self.stats is not None:
+                self.stats["inject"] = time.time() - start
+            cached = [None if injected == data else injected]
+            store.archive(name + "-injected").put(key, cached)
+
+        if cached[0] is None:
+            return data
+        return cached[0]
+
+    def inject_heartbeat(self, ctype, data):
+        if not ctype.startswith("text/html"):
+            return data
+        if "</head>" in data:
+            return data.replace("</head>", HeartbeatScript + "</head>", 1)
+        return data.replace("</body>", HeartbeatScript + "</body>", 1)
+
     def inject_data(self, host, path, data):
         global benchmarks
         for benchmark in benchmarks.Known:
@@ -270,12 +502,26 @@ class FakeHandler(SimpleHTTPRequestHandler):
                                     'xmlHttp.open("POST", "/submit", true);');
         return data
 
+class ThreadedHTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """ Benchmarks load many subresources in parallel. Serve every
+    connection on its own thread. """
+    daemon_threads = True
+
 HandlerClass = FakeHandler
-ServerClass  = BaseHTTPServer.HTTPServer
-Protocol     = "HTTP/1.0"
+ServerClass  = ThreadedHTTPServer
+Protocol     = "HTTP/1.1"
 Port = 8000
 ServerAddress = ('', Port)
 
+parser = OptionParser(usage="usage: %prog [options]")
+parser.add_option("-m", "--mode", dest="mode", type="string",
+                  default=utils.config.getDefault('main', 'proxyMode', 'cache'),
+                  help="How to handle remote benchmarks: " + ", ".join(replay.Modes) +
+                       ". 'record' refetches everything, 'replay' never goes to the network.")
+(options, args) = parser.parse_args()
+
+store = replay.Store(options.mode)
+
 path = os.path.abspath(os.path.join(os.path.dirname(__file__),".."))
 with utils.chdir(path):
     HandlerClass.protocol_version = Protocol
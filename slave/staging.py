@@ -0,0 +1,138 @@
+"""
+Staging of benchmark trees and engines on a RAM disk.
+
+When the 'stagingDir' option points to a tmpfs (e.g. /dev/shm/awfy), the
+benchmark folder of shell benchmarks and the engine are copied there before
+running, so disk I/O and the page cache state don't add noise. Files get
+hardlinked instead when the source is on the same filesystem.
+
+Staged copies are keyed by a fingerprint of the files in the source folder
+(names, sizes and modification times), so they are reused across configs,
+repeated runs and later invocations of execute.py, and a changed source gets
+staged anew. Every use touches the copy; prune() evicts the least recently
+used ones beyond 'stagingKeep' and those unused for 'stagingMaxAge' seconds.
+"""
+
+import hashlib
+import os
+import shutil
+import time
+
+import utils
+
+def keep():
+    return int(utils.config.getDefault('main', 'stagingKeep', 8))
+
+def max_age():
+    return int(eval(utils.config.getDefault('main', 'stagingMaxAge', "7*24*60*60"), {}))
+
+def folder():
+    return utils.config.getDefault('main', 'stagingDir', None)
+
+def enabled(platform):
+    return folder() is not None and platform == "linux"
+
+def source_files(path, recursive):
+    if not recursive:
+        return sorted(name for name in os.listdir(path)
+                      if os.path.isfile(os.path.join(path, name)))
+
+    files = []
+    for root, dirs, names in os.walk(path):
+        for name in names:
+            files.append(os.path.relpath(os.path.join(root, name), path))
+    return sorted(files)
+
+def fingerprint(path, files, recursive):
+    h = hashlib.sha1(os.path.abspath(path) + ("/*" if recursive else ""))
+    for name in files:
+        st = os.lstat(os.path.join(path, name))
+        h.update("\0".join([name, str(st.st_size), str(st.st_mtime)]) + "\n")
+    return h.hexdigest()
+
+def copy(source, target, files):
+    os.makedirs(target)
+    same_device = os.stat(source).st_dev == os.stat(os.path.dirname(target)).st_dev
+    for name in files:
+        src = os.path.join(source, name)
+        dst = os.path.join(target, name)
+        if not os.path.isdir(os.path.dirname(dst)):
+            os.makedirs(os.path.dirname(dst))
+        if os.path.islink(src):
+            os.symlink(os.readlink(src), dst)
+        elif same_device:
+            os.link(src, dst)
+        else:
+            shutil.copy2(src, dst)
+
+def stage(path, recursive=True):
+    """
+    Returns the staged copy of the folder at path. Without recursive only the
+    files directly in it get staged.
+    """
+    path = path.rstrip("/")
+    files = source_files(path, recursive)
+    name = os.path.basename(path) + "-" + fingerprint(path, files, recursive)
+    target = os.path.join(folder(), name)
+    if os.path.isdir(target):
+        os.utime(target, None)
+        return target
+
+    if not os.path.isdir(folder()):
+        os.makedirs(folder())
+
+    print "Staging", path, "in", target
+    tmp = target + ".tmp" + str(os.getpid())
+    copy(path, tmp, files)
+    try:
+        os.rename(tmp, target)
+    except OSError:
+        # Somebody else (another lane) staged it in the meantime.
+        shutil.rmtree(tmp)
+    return target
+
+def stage_engine(engineInfo):
+    """
+    Returns a copy of engineInfo with the binary pointing into the staged
+    engine. Browsers get their whole folder staged, shells only the files
+    next to the binary.
+    """
+    info = dict(engineInfo)
+    if "folder" in info:
+        source = info["folder"]
+        target = info["folder"] = stage(source)
+    else:
+        source = os.path.dirname(info["binary"])
+        target = stage(source, recursive=False)
+    info["binary"] = os.path.join(target, os.path.relpath(engineInfo["binary"], source))
+    return info
+
+def prune():
+    """
+    Evicts staged copies, least recently used first, so only the 'stagingKeep'
+    most recent ones that were used in the last 'stagingMaxAge' seconds stay.
+    """
+    if folder() is None or not os.path.isdir(folder()):
+        return
+
+    now = time.time()
+    staged, unfinished = [], []
+    for name in os.listdir(folder()):
+        path = os.path.join(folder(), name)
+        used = os.stat(path).st_mtime
+        if ".tmp" in name:
+            # Still being copied by another process, unless it got abandoned.
+            if now - used > max_age():
+                unfinished.append(path)
+        else:
+            staged.append((used, path))
+    staged.sort(reverse=True)
+
+    evict = unfinished
+    for i, (used, path) in enumerate(staged):
+        if i >= keep() or now - used > max_age():
+            evict.append(path)
+
+    for path in evict:
+        print "Removing staged copy", path
+        shutil.rmtree(path, ignore_errors=True)
@@ -44,6 +44,13 @@ class Submitter(object):
     def set_machine(self, machine):
         self.machine = machine
 
+    def describe_samples(self, test):
+        """ Tests that were repeated carry the stddev and number of samples
+        of their mean time. """
+        if 'samples' not in test:
+            return ""
+        return "stddev {:.4g}, {} samples".format(test['stddev'], test['samples'])
+
 class RemoteSubmitter(Submitter):
 
     def mode(self, engine_type, config):
@@ -115,7 +122,8 @@ class RemoteSubmitter(Submitter):
             run = self.runIds[i]
             for test in tests:
                 if test['name'] == "__total__":
-                    score = self.submit_test(submiturl, run, suite, suiteversion, mode, test['time'], extra_info)
+                    info = ", ".join(filter(None, [extra_info, self.describe_samples(test)]))
+                    score = self.submit_test(submiturl, run, suite, suiteversion, mode, test['time'], info)
                     break
 
             if score is None:
@@ -174,6 +182,8 @@ class RemoteSubmitter(Submitter):
 class PrintSubmitter(Submitter):
     def __init__(self):
         self.msg = ''
+        # Nothing gets submitted, so there are no run ids.
+        self.runIds = [None]
 
     def log(self, msg):
         self.msg += msg + '\n'
@@ -185,6 +195,10 @@ class PrintSubmitter(Submitter):
             msg += " at timestamp" + str(timestamp)
         self.log(msg)
 
+    def start_out_of_order(self, mode, revision, run_before, run_after):
+        self.log("Starting out of order benchmark of %s (mode: %s, between runs %s and %s)" %
+                 (revision, mode, run_before, run_after))
+
     def create_build(self, engine_type, config, cset):
         mode = self.mode(engine_type, config)
         self.log("Added mode %s (engine: %s, config: %s, changeset: %s)" % (mode, engine_type, config, cset))
@@ -192,10 +206,14 @@ class PrintSubmitter(Submitter):
 
     def add_tests(self, tests, suite, suiteversion, mode, extra_info = ""):
         for test in tests:
-            self.submit_test(test['name'], suite, suiteversion, mode, test['time'], extra_info)
+            info = ", ".join(filter(None, [extra_info, self.describe_samples(test)]))
+            self.submit_test(test['name'], suite, suiteversion, mode, test['time'], info)
 
     def submit_test(self, name, suite, suiteversion, mode, time, extra_info = ""):
-        self.log("%s (%s -- %s): %s" % (name, suiteversion, mode, str(time)))
+        msg = "%s (%s -- %s): %s" % (name, suiteversion, mode, str(time))
+        if extra_info:
+            msg += " (%s)" % extra_info
+        self.log(msg)
 
     def finish(self, status = 1):
         print "\n*******************************************\nSummary: "
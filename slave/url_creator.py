@@ -1,9 +1,105 @@
+import contextlib
+import fcntl
+import json
+import os
 import platform
+import tempfile
+import threading
+import time
 import urllib2
 import re
 
+from multiprocessing.pool import ThreadPool
+
 import utils
 
+# Lookups that resolve 'latest' are cached this long, in seconds. Lookups of
+# pinned revisions never change and are cached forever.
+LatestTTL = 5 * 60
+
+# Number of revisions find_many() resolves concurrently.
+MaxWorkers = 4
+
+class ResolutionCache(object):
+    """
+    Results of index and listing lookups, persisted in url-cache.json so a
+    bisection doesn't look up the same revisions over and over again.
+
+    Prefetches, downloads and bisections share the file, so it is only
+    written while holding a lock on url-cache.json.lock.
+    """
+
+    def __init__(self, path="url-cache.json"):
+        self.path = path
+        self.entries = None
+        self.lock = threading.Lock()
+
+    def read(self):
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, "r") as fp:
+                return json.load(fp)
+        except ValueError:
+            return {}
+
+    def load(self):
+        self.entries = self.read()
+
+    @contextlib.contextmanager
+    def locked(self):
+        with open(self.path + ".lock", "w") as fp:
+            fcntl.flock(fp, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(fp, fcntl.LOCK_UN)
+
+    def save(self, key):
+        """
+        Adds the entry of key to the file, keeping what other processes
+        added in the meantime. Expired entries are dropped.
+        """
+        with self.locked():
+            entries = self.read()
+            entries[key] = self.entries[key]
+            now = time.time()
+            entries = dict((name, entry) for name, entry in entries.items()
+                           if entry["expires"] is None or entry["expires"] > now)
+            self.entries.update(entries)
+
+            fd, tmp = tempfile.mkstemp(prefix=os.path.basename(self.path) + ".",
+                                       dir=os.path.dirname(os.path.abspath(self.path)))
+            with os.fdopen(fd, "w") as fp:
+                json.dump(entries, fp)
+            os.rename(tmp, self.path)
+
+    def get(self, key, ttl, compute):
+        """
+        Returns the cached value of key, or compute() when it is not cached
+        or expired. ttl is None for values that never expire.
+        """
+        with self.lock:
+            if self.entries is None:
+                self.load()
+            entry = self.entries.get(key)
+        if entry and (entry["expires"] is None or entry["expires"] > time.time()):
+            return entry["value"]
+
+        value = compute()
+        with self.lock:
+            self.entries[key] = { "value": value,
+                                  "expires": None if ttl is None else time.time() + ttl }
+            self.save(key)
+        return value
+
+cache = ResolutionCache()
+
+def fetch(url, ttl):
+    def compute():
+        return urllib2.urlopen(url).read()
+    return cache.get("fetch " + url, ttl, compute)
+
 class UrlCreator(object):
     def __init__(self, config, repo, other_platform=None):
         self.repo = repo
@@ -18,6 +114,24 @@ class UrlCreator(object):
             urls = self.url_for_revision(cset, **kwargs)
         return urls
 
+    def find_many(self, csets, max_workers=MaxWorkers, **kwargs):
+        """
+        Resolves many revisions concurrently. Returns a dictionary with the
+        urls of every revision, or the exception raised while resolving it.
+        """
+        def resolve(cset):
+            try:
+                return cset, self.find(cset, **kwargs)
+            except Exception as e:
+                return cset, e
+
+        pool = ThreadPool(min(max_workers, max(len(csets), 1)))
+        try:
+            return dict(pool.map(resolve, csets))
+        finally:
+            pool.close()
+            pool.join()
+
 class ChromeUrlCreator(UrlCreator):
 
     def _url_base(self):
@@ -40,19 +154,17 @@ class ChromeUrlCreator(UrlCreator):
         raise Exception("Unknown platform: " + self.platform)
 
     def latest(self, **kwargs):
-        response = urllib2.urlopen(self._url_base() + "LAST_CHANGE")
-        chromium_rev = response.read()
+        chromium_rev = fetch(self._url_base() + "LAST_CHANGE", LatestTTL)
 
-        response = urllib2.urlopen(self._url_base() + chromium_rev + "/REVISIONS")
-        cset = re.findall('"v8_revision_git": "([a-z0-9]*)",', response.read())[0]
+        revisions = fetch(self._url_base() + chromium_rev + "/REVISIONS", None)
+        cset = re.findall('"v8_revision_git": "([a-z0-9]*)",', revisions)[0]
 
         return [self._url_base() + chromium_rev + "/"]
 
 class WebKitUrlCreator(UrlCreator):
 
     def latest(self, **kwargs):
-        response = urllib2.urlopen("https://webkit.org/downloads/")
-        html = response.read()
+        html = fetch("https://webkit.org/downloads/", LatestTTL)
 
         url = re.findall("https://builds-nightly.webkit.org/files/trunk/mac/WebKit-SVN-r[0-9]*.dmg", html)
         return url
@@ -108,7 +220,8 @@ class TaskClusterIndexHelper(object):
                     platform,
                     buildtype)
 
-        return utils.fetch_json(url)['taskId']
+        ttl = None if revision else LatestTTL
+        return cache.get("taskId " + url, ttl, lambda: utils.fetch_json(url)['taskId'])
 
     @classmethod
     def _artifact_to_filename(cls, platform):
@@ -8,6 +8,9 @@ import sys
 import commands
 import subprocess
 import signal
+import select
+import socket
+import time
 import ConfigParser
 import json
 import urllib
@@ -250,3 +253,119 @@ def make_log(name):
 def flush():
     sys.stdout.flush()
     sys.stderr.flush()
+
+class AutoSpawnServer:
+    def __init__(self, log, mode=None):
+        self.server = None
+        self.log = log
+        self.mode = mode
+
+    def __enter__(self):
+        self.log("Starting proxy server.")
+        args = ['python', 'server.py']
+        if self.mode:
+            args += ['--mode', self.mode]
+        self.server = subprocess.Popen(args)
+
+    def __exit__(self, type, value, traceback):
+        self.log("Terminating proxy server.")
+        if self.server:
+            self.server.terminate()
+            self.server = None
+
+def results_address():
+    port = int(config.getDefault('main', 'resultsPort', 8001))
+    return ('127.0.0.1', port)
+
+def notify(message):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        sock.sendto(message, results_address())
+    except socket.error:
+        pass
+    finally:
+        sock.close()
+
+def notify_results():
+    """
+    Tells a waiting ResultsListener that the results file has been written.
+    """
+    notify("results")
+
+def notify_heartbeat():
+    """
+    Tells a waiting ResultsListener that the benchmark page is still making
+    progress.
+    """
+    notify("heartbeat")
+
+def set_harness_page(url):
+    """
+    Tells the proxy which page the browser opens, so only that page gets the
+    heartbeat injected.
+    """
+    try:
+        urllib2.urlopen("http://localhost:8000/harness?" + urllib.urlencode({ "url": url }), timeout=10)
+    except Exception as e:
+        print "Couldn't register the harness page: {}".format(e)
+
+def take_proxy_stats():
+    """
+    Returns the requests the proxy served since the last call, with their
+    summary, or None when the proxy can't be reached.
+    """
+    try:
+        response = urllib2.urlopen("http://localhost:8000/proxy-stats", timeout=10)
+        return json.loads(response.read())
+    except Exception as e:
+        print "Couldn't retrieve the proxy stats: {}".format(e)
+        return None
+
+class ResultsListener(object):
+    """
+    Waits for the notification the server sends after capturing results, so
+    the benchmark can be stopped immediately instead of on the next poll.
+    When the port can't be bound, wait() just sleeps.
+    """
+    def __init__(self):
+        self.sock = None
+
+    def __enter__(self):
+        try:
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.sock.bind(results_address())
+        except socket.error as e:
+            print "Not listening for results ({}), polling instead.".format(e)
+            self.sock = None
+        return self
+
+    def __exit__(self, type, value, traceback):
+        if self.sock:
+            self.sock.close()
+            self.sock = None
+
+    def wait(self, timeout):
+        """
+        Returns the received message, or None if nothing arrived in time.
+        """
+        if not self.sock:
+            time.sleep(timeout)
+            return None
+
+        ready, _, _ = select.select([self.sock], [], [], timeout)
+        if ready:
+            return self.sock.recv(64)
+        return None
+
+def wait_for_file(path, timeout, listener, interval=10):
+    """
+    Waits at most timeout seconds for path to exist. The file is still checked
+    every interval seconds, in case a notification gets lost.
+    """
+    end = time.time() + timeout
+    while not os.path.exists(path):
+        remaining = end - time.time()
+        if remaining <= 0:
+            return False
+        listener.wait(min(interval, remaining))
+    return True
@@ -0,0 +1,144 @@
+#!/usr/bin/env python2
+
+import SimpleHTTPServer
+import SocketServer
+import StringIO
+import os
+import shutil
+import sys
+import tarfile
+import tempfile
+import threading
+sys.path.append("../slave")
+
+import download
+
+FILES = {
+    "js": os.urandom(256 * 1024),
+    "lib/libnss3.so": "library",
+    "README": "shell"
+}
+
+class StandInBuilds(SimpleHTTPServer.SimpleHTTPRequestHandler):
+    """
+    Serves the files in StandInBuilds.folder.
+    """
+    folder = None
+
+    def translate_path(self, path):
+        return os.path.join(StandInBuilds.folder, path.lstrip("/"))
+
+    def log_message(self, *args):
+        pass
+
+class StandInDownloader(download.Downloader):
+    def get_filename(self):
+        return "build.tar.bz2"
+
+    def retrieve_info(self):
+        return {}
+
+class RecordingReader(download.ProgressReader):
+    """
+    Reports the progress after every read and remembers what it read.
+    """
+    readers = []
+
+    def __init__(self, fp, total=None, interval=5):
+        super(RecordingReader, self).__init__(fp, total, 0)
+        RecordingReader.readers.append(self)
+
+def make_archive(folder):
+    source = os.path.join(folder, "source")
+    for name, content in FILES.items():
+        path = os.path.join(source, name)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, "wb") as fp:
+            fp.write(content)
+
+    archive = os.path.join(folder, "build.tar.bz2")
+    tar = tarfile.open(archive, "w:bz2")
+    for name in FILES:
+        tar.add(os.path.join(source, name), name)
+    tar.close()
+    return os.path.getsize(archive)
+
+def check_download(url, output, stream):
+    """
+    Downloads the build and returns the failures and what got printed.
+    """
+    downloader = StandInDownloader(url)
+    downloader.set_output_folder(output)
+    downloader.stream = stream
+
+    stdout = sys.stdout
+    sys.stdout = StringIO.StringIO()
+    try:
+        downloader.download()
+        printed = sys.stdout.getvalue()
+    finally:
+        sys.stdout = stdout
+
+    failures = []
+    for name, content in FILES.items():
+        path = os.path.join(output, name)
+        if not os.path.isfile(path) or open(path, "rb").read() != content:
+            failures.append("{} wasn't extracted".format(name))
+    if downloader.streamed != stream:
+        failures.append("streamed is {}".format(downloader.streamed))
+    if os.path.exists(os.path.join(output, "build.tar.bz2")) == stream:
+        failures.append("the archive was{} written to disk".format("" if stream else "n't"))
+    return failures, printed
+
+def test_download(stream):
+    print("Testing the {} download of a tarball".format("streamed" if stream else "unstreamed"))
+    folder = tempfile.mkdtemp()
+    size = make_archive(folder)
+
+    StandInBuilds.folder = folder
+    server = SocketServer.TCPServer(("localhost", 0), StandInBuilds)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    old_reader = download.ProgressReader
+    download.ProgressReader = RecordingReader
+    RecordingReader.readers = []
+    try:
+        url = "http://localhost:{}/".format(server.server_address[1])
+        failures, printed = check_download(url, os.path.join(folder, "output"), stream)
+
+        reader = RecordingReader.readers[0]
+        if reader.total != size or reader.bytes != size:
+            failures.append("read {} of {} bytes, expected {}".format(reader.bytes, reader.total, size))
+        if "of {:.1f} MB (100%)".format(size / 1e6) not in printed:
+            failures.append("progress wasn't reported")
+        if "Downloaded {:.1f} MB in".format(size / 1e6) not in printed:
+            failures.append("throughput wasn't reported")
+    finally:
+        download.ProgressReader = old_reader
+        server.shutdown()
+        server.server_close()
+        shutil.rmtree(folder)
+
+    for failure in failures:
+        print "FAILED: " + failure
+    if not failures:
+        print "PASSED\n"
+    return [("download", stream, failure) for failure in failures]
+
+def main():
+    failures = test_download(stream=True)
+    failures += test_download(stream=False)
+
+    if len(failures) > 0:
+        print "FAILURES:"
+        for f in failures:
+            print f
+        exit(1)
+    else:
+        exit(0)
+
+if __name__ == '__main__':
+    main()
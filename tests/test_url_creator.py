@@ -1,6 +1,13 @@
 #!/usr/bin/env python2
 
+import BaseHTTPServer
+import json
+import os
+import shutil
 import sys
+import tempfile
+import threading
+import time
 sys.path.append("../slave")
 
 import url_creator
@@ -75,8 +82,92 @@ def test_configuration(repo, platform, arch=None, buildtype=None, cset='latest')
         return [(repo, platform, arch, buildtype, cset)]
 
 
-def main():
+class StandInIndex(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    Answers every index lookup with a new taskId, and remembers the lookups.
+    """
+    lookups = []
+
+    def do_GET(self):
+        StandInIndex.lookups.append(self.path)
+        body = json.dumps({ "taskId": "task-" + str(len(StandInIndex.lookups)) })
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", len(body))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+def test_resolution_cache():
+    print("Testing the resolution cache against a stand-in index")
+    server = BaseHTTPServer.HTTPServer(("localhost", 0), StandInIndex)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+
+    helper = url_creator.TaskClusterIndexHelper
+    old_index_url, old_cache = helper._index_url, url_creator.cache
+    folder = tempfile.mkdtemp()
+    path = os.path.join(folder, "url-cache.json")
+    helper._index_url = "http://localhost:{}/task".format(server.server_address[1])
+    url_creator.cache = url_creator.ResolutionCache(path)
+
+    def resolve(revision=None):
+        return helper._task_id("mozilla-inbound", "firefox", "linux64", "opt", revision)
+
+    def read():
+        with open(path) as fp:
+            return json.load(fp)
+
+    def age(key):
+        entries = read()
+        entries[key]["expires"] = time.time() - 1
+        with open(path, "w") as fp:
+            json.dump(entries, fp)
+        url_creator.cache = url_creator.ResolutionCache(path)
+
     failures = []
+    try:
+        # Latest lookups are answered from the cache until they expire.
+        latest = resolve()
+        if resolve() != latest or len(StandInIndex.lookups) != 1:
+            failures.append("latest lookup wasn't cached")
+
+        latest_key = [key for key in read() if "latest" in key][0]
+        age(latest_key)
+        if resolve() == latest or len(StandInIndex.lookups) != 2:
+            failures.append("expired latest lookup was used")
+
+        # Lookups of pinned revisions never expire, also in a new process.
+        pinned = resolve("abcdef")
+        url_creator.cache = url_creator.ResolutionCache(path)
+        if resolve("abcdef") != pinned or len(StandInIndex.lookups) != 3:
+            failures.append("pinned lookup wasn't cached")
+        if [entry["expires"] for key, entry in read().items() if "abcdef" in key] != [None]:
+            failures.append("pinned lookup expires")
+
+        # Expired entries are dropped when the file is written.
+        age(latest_key)
+        resolve("012345")
+        if latest_key in read():
+            failures.append("expired lookup was kept")
+        if [name for name in os.listdir(folder) if name not in ["url-cache.json", "url-cache.json.lock"]]:
+            failures.append("temporary files were left behind")
+    finally:
+        server.shutdown()
+        helper._index_url, url_creator.cache = old_index_url, old_cache
+        shutil.rmtree(folder)
+
+    for failure in failures:
+        print "FAILED: " + failure
+    if not failures:
+        print "PASSED\n"
+    return [("resolution cache", failure) for failure in failures]
+
+def main():
+    failures = test_resolution_cache()
 
     for repo in REPOS:
         for platform in PLATFORMS: